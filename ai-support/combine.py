@@ -1,8 +1,16 @@
+import codecs
 import os
+import re
 import fnmatch
+import functools
+import operator
+import shutil
+
+# Buffer size used when streaming file contents into the combined output
+COPY_BUFFER_SIZE = 1 << 16
 
 def combine_files(directory_paths, patterns=None, output_file='combined_output.txt', exclude_folders=None,
-                  max_lines_per_file=None, truncation_message=None, compact_code=False):
+                  max_lines_per_file=None, truncation_message=None, compact_code=False, verbose=False):
     """
     Combine files matching any of the specified patterns from multiple directories,
     excluding specified folders, with optional line cutoff per file and code compacting.
@@ -19,6 +27,7 @@ def combine_files(directory_paths, patterns=None, output_file='combined_output.t
         truncation_message (str): Custom message to display when a file is truncated.
                                  If None, uses a default message
         compact_code (bool): If True, removes excessive whitespace while preserving logical structure
+        verbose (bool): If True, prints the list of files to be added before combining them
     """
     if patterns is None:
         patterns = ['*.py']
@@ -33,73 +42,125 @@ def combine_files(directory_paths, patterns=None, output_file='combined_output.t
     if isinstance(directory_paths, str):
         directory_paths = [directory_paths]
 
-    def should_exclude_folder(folder_path):
+    # Exclude patterns are translated once; folder names repeat a lot, so decisions are memoized by name
+    exclude_re = re.compile('|'.join(fnmatch.translate(pattern) for pattern in exclude_folders)) if exclude_folders else None
+
+    @functools.lru_cache(maxsize=4096)
+    def should_exclude_folder(folder_name):
         """Check if a folder should be excluded based on exclude_folders patterns."""
-        folder_name = os.path.basename(folder_path)
-        for exclude_pattern in exclude_folders:
-            if fnmatch.fnmatch(folder_name, exclude_pattern):
-                return True
-        return False
+        return exclude_re is not None and exclude_re.match(folder_name) is not None
 
-    def compact_code_content(lines):
+    def count_lines(f):
+        """
+        Count lines the way splitlines() would, reading a binary file a block at a time
+        from its current position without holding it in memory. Each block is also decoded, so a
+        file that isn't valid UTF-8 raises UnicodeDecodeError before any of it is written.
         """
-        Remove excessive whitespace while preserving logical structure.
-        Keeps single blank lines between logical sections but removes multiple consecutive blank lines.
+        line_count = 0
+        last_chunk = b''
+        decoder = codecs.getincrementaldecoder('utf-8')()
+        for chunk in iter(lambda: f.read(COPY_BUFFER_SIZE), b''):
+            decoder.decode(chunk)
+            line_count += chunk.count(b'\n')
+            last_chunk = chunk
+        decoder.decode(b'', final=True)
+        # A final line without a trailing newline still counts as a line
+        if last_chunk and not last_chunk.endswith(b'\n'):
+            line_count += 1
+        return line_count
+
+    def write_lines(infile, outfile=None, limit=None):
         """
-        if not compact_code:
-            return lines
+        Walk the lines of a text file once from the start, writing them to outfile (when given) until limit
+        lines have been written. With compact_code, multiple consecutive blank lines are collapsed into one
+        and trailing blank lines are dropped as the lines stream past, holding back at most one blank line.
 
-        compacted_lines = []
+        Returns:
+            tuple: Number of lines kept and number of lines read
+        """
+        kept_lines = 0
+        read_lines = 0
         prev_line_empty = False
+        pending_empty_line = None
+
+        infile.seek(0)
+        for line in infile:
+            if limit is not None and kept_lines >= limit:
+                break
+            read_lines += 1
+
+            if compact_code:
+                is_empty = not line.strip()
+
+                # Skip multiple consecutive empty lines
+                if is_empty and prev_line_empty:
+                    continue
 
-        for line in lines:
-            stripped = line.strip()
-            is_empty = len(stripped) == 0
+                prev_line_empty = is_empty
+                if is_empty:
+                    # Only kept once a non-empty line follows, which drops trailing empty lines
+                    pending_empty_line = line
+                    continue
 
-            # Skip multiple consecutive empty lines
-            if is_empty and prev_line_empty:
-                continue
+                if pending_empty_line is not None:
+                    if outfile is not None:
+                        outfile.write(pending_empty_line)
+                    kept_lines += 1
+                    pending_empty_line = None
+                    if limit is not None and kept_lines >= limit:
+                        break
 
-            # Keep the line (either non-empty or first empty line in a sequence)
-            compacted_lines.append(line)
-            prev_line_empty = is_empty
+            if outfile is not None:
+                outfile.write(line)
+            kept_lines += 1
 
-        # Remove trailing empty lines
-        while compacted_lines and compacted_lines[-1].strip() == '':
-            compacted_lines.pop()
+        return kept_lines, read_lines
 
-            # Get all matching files from all directories
+    # Get all matching files from all directories
     matching_files = []
     excluded_folders = set()
 
+    # Translate every pattern once into a single union regex instead of calling fnmatch per pattern per file
+    pattern_re = re.compile('|'.join(fnmatch.translate(pattern) for pattern in patterns) or r'(?!)')
+
+    def scan_directory(root, relative_root=''):
+        """
+        Recursively yield (full_path, relative_path) for files under root matching any of the patterns,
+        skipping excluded folders. Relative paths are built up as prefixes during the descent instead of
+        being recomputed from the full path of every file.
+        Uses os.scandir so directory entries are classified without an extra stat call per file.
+        """
+        try:
+            entries = os.scandir(root)
+        except OSError:
+            return
+
+        with entries:
+            for entry in entries:
+                try:
+                    is_dir = entry.is_dir()
+                except OSError:
+                    is_dir = False
+
+                if is_dir:
+                    if should_exclude_folder(entry.name):
+                        excluded_folders.add(relative_root + entry.name)
+                    elif not entry.is_symlink():
+                        # Like os.walk, don't follow symlinked directories
+                        yield from scan_directory(entry.path, f'{relative_root}{entry.name}{os.sep}')
+                elif pattern_re.match(entry.name):
+                    yield entry.path, relative_root + entry.name
+
     for directory_path in directory_paths:
         if not os.path.exists(directory_path):
             print(f"Warning: Directory '{directory_path}' does not exist. Skipping...")
             continue
 
         print(f"Scanning directory: {directory_path}")
-        for root, dirs, files in os.walk(directory_path):
-            # Remove excluded directories from dirs list to prevent os.walk from entering them
-            dirs_to_remove = []
-            for dir_name in dirs:
-                dir_path = os.path.join(root, dir_name)
-                if should_exclude_folder(dir_path):
-                    dirs_to_remove.append(dir_name)
-                    excluded_folders.add(os.path.relpath(dir_path, directory_path))
-
-            # Remove excluded directories from the list
-            for dir_name in dirs_to_remove:
-                dirs.remove(dir_name)
-
-            # Process files in current directory
-            for file in files:
-                # Check if the file matches any of the patterns
-                if any(fnmatch.fnmatch(file, pattern) for pattern in patterns):
-                    full_path = os.path.join(root, file)
-                    matching_files.append(full_path)
-
-    # Sort files for consistent output
-    matching_files.sort()
+        matching_files.extend(scan_directory(directory_path))
+
+    # Sort files for consistent output; paths are unique, so there is no need to compare whole tuples
+    matching_files.sort(key=operator.itemgetter(0))
 
     print(f"Found {len(matching_files)} matching files")
     if max_lines_per_file:
@@ -109,18 +170,12 @@ def combine_files(directory_paths, patterns=None, output_file='combined_output.t
     if excluded_folders:
         print(f"Excluded folders: {', '.join(sorted(excluded_folders))}")
 
-    # Print summary of files to be added
-    print("\nFiles to be added to output:")
-    print("-" * 50)
-    for i, file_path in enumerate(matching_files, 1):
-        # Get relative path for display
-        relative_path = file_path
-        for dir_path in directory_paths:
-            if file_path.startswith(dir_path):
-                relative_path = os.path.relpath(file_path, dir_path)
-                break
-        print(f"{i:3d}. {relative_path}")
-    print("-" * 50)
+    # Print summary of files to be added, as a single write since large trees can list thousands of files
+    if verbose:
+        summary = ["\nFiles to be added to output:", "-" * 50]
+        summary.extend(f"{i:3d}. {relative_path}" for i, (file_path, relative_path) in enumerate(matching_files, 1))
+        summary.append("-" * 50)
+        print('\n'.join(summary))
 
     # Statistics tracking
     total_files_truncated = 0
@@ -142,82 +197,70 @@ def combine_files(directory_paths, patterns=None, output_file='combined_output.t
         outfile.write(f'# Generated on: {os.path.basename(output_file)}\n\n')
         outfile.write('=' * 80 + '\n\n')
 
-        for file_path in matching_files:
+        for file_path, relative_path in matching_files:
             # Write the file header with relative path from original directory
-            relative_path = file_path
-            for dir_path in directory_paths:
-                if file_path.startswith(dir_path):
-                    relative_path = os.path.relpath(file_path, dir_path)
-                    break
-
             outfile.write(f'# File: {relative_path}\n')
 
             try:
-                # Read the content of the file
-                with open(file_path, 'r', encoding='utf-8') as infile:
-                    content = infile.read()
-
-                # Ensure we have valid content
-                if content is None:
-                    raise ValueError("File content is None")
-
-                # Split into lines while preserving line endings
-                lines = content.splitlines(keepends=True)
-
-                # Ensure lines is not None and is a list
-                if lines is None:
-                    lines = []
-
-                original_line_count = len(lines)
-
-                # Apply code compacting if enabled and we have lines
-                if compact_code and lines:
-                    compacted_lines = compact_code_content(lines)
-                    if compacted_lines is not None:
-                        lines = compacted_lines
-
-                total_file_lines = len(lines)
-
-                # Check if we need to truncate
-                if max_lines_per_file and total_file_lines > max_lines_per_file:
-                    display_info = f'{max_lines_per_file}/{total_file_lines} (truncated'
-                    if compact_code and original_line_count != total_file_lines:
-                        display_info += f', compacted from {original_line_count}'
-                    display_info += ')'
-                    outfile.write(f'# Lines: {display_info}\n')
+                # Empty files have nothing to transform
+                if (not compact_code and not max_lines_per_file) or os.path.getsize(file_path) == 0:
+                    # Nothing to transform, so stream the file instead of building the full string and line list
+                    with open(file_path, 'rb') as raw_infile:
+                        # Validate the whole file while counting, so non-text files are reported before anything is written
+                        total_file_lines = count_lines(raw_infile)
+                    outfile.write(f'# Lines: {total_file_lines}\n')
                     outfile.write('-' * 80 + '\n\n')
-
-                    # Write only the first max_lines_per_file lines
-                    for line in lines[:max_lines_per_file]:
-                        outfile.write(line)
-
-                    # Add truncation message
-                    outfile.write(f'\n\n# {truncation_message}\n')
-                    outfile.write(f'# {total_file_lines - max_lines_per_file} lines were truncated from this file.\n')
-
-                    total_files_truncated += 1
-                    total_lines_processed += max_lines_per_file
-
-                    # Track truncated file
-                    truncated_files.append({
-                        'path': relative_path,
-                        'original_lines': original_line_count,
-                        'final_lines': total_file_lines,
-                        'truncated_to': max_lines_per_file,
-                        'lines_removed': total_file_lines - max_lines_per_file
-                    })
-                else:
-                    display_info = f'{total_file_lines}'
-                    if compact_code and original_line_count != total_file_lines:
-                        display_info += f' (compacted from {original_line_count})'
-                    outfile.write(f'# Lines: {display_info}\n')
-                    outfile.write('-' * 80 + '\n\n')
-
-                    # Write all lines
-                    for line in lines:
-                        outfile.write(line)
+                    with open(file_path, 'r', encoding='utf-8') as infile:
+                        shutil.copyfileobj(infile, outfile, COPY_BUFFER_SIZE)
 
                     total_lines_processed += total_file_lines
+                    outfile.write('\n\n' + '=' * 80 + '\n\n')
+                    continue
+
+                # Stream the file line by line rather than reading it into one string and a list of lines
+                with open(file_path, 'r', encoding='utf-8', buffering=COPY_BUFFER_SIZE) as infile:
+                    # Counting pass, which also yields the pre-compaction count; decoding here rejects
+                    # non-text files before anything is written
+                    total_file_lines, original_line_count = write_lines(infile)
+
+                    # Check if we need to truncate
+                    if max_lines_per_file and total_file_lines > max_lines_per_file:
+                        display_info = f'{max_lines_per_file}/{total_file_lines} (truncated'
+                        if compact_code and original_line_count != total_file_lines:
+                            display_info += f', compacted from {original_line_count}'
+                        display_info += ')'
+                        outfile.write(f'# Lines: {display_info}\n')
+                        outfile.write('-' * 80 + '\n\n')
+
+                        # Write only the first max_lines_per_file lines
+                        write_lines(infile, outfile, max_lines_per_file)
+
+                        # Add truncation message
+                        outfile.write(f'\n\n# {truncation_message}\n')
+                        outfile.write(f'# {total_file_lines - max_lines_per_file} lines were truncated from this file.\n')
+
+                        total_files_truncated += 1
+                        total_lines_processed += max_lines_per_file
+
+                        # Track truncated file
+                        truncated_files.append({
+                            'path': relative_path,
+                            'original_lines': original_line_count,
+                            'final_lines': total_file_lines,
+                            'truncated_to': max_lines_per_file,
+                            'lines_removed': total_file_lines - max_lines_per_file
+                        })
+                    else:
+                        display_info = f'{total_file_lines}'
+                        if compact_code and original_line_count != total_file_lines:
+                            display_info += f' (compacted from {original_line_count})'
+                        outfile.write(f'# Lines: {display_info}\n')
+                        outfile.write('-' * 80 + '\n\n')
+
+                        # Write all lines
+                        write_lines(infile, outfile)
+
+                        total_lines_processed += total_file_lines
 
             except UnicodeDecodeError:
                 outfile.write('# Lines: Unable to read (not a text file)\n')
@@ -296,5 +339,8 @@ if __name__ == '__main__':
     # NEW: Enable code compacting to remove excessive whitespace
     compact_code = True
 
+    # Print every file that will be added before combining
+    verbose = True
+
     combine_files(directory_paths, patterns, output_file, exclude_folders,
-                  max_lines_per_file, truncation_message, compact_code)
+                  max_lines_per_file, truncation_message, compact_code, verbose)
@@ -1,54 +1,187 @@
 import gzip
+import io
 import json
-import jsonlines
 import logging
+import orjson
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from isal import igzip
+from itertools import islice
 from os import getenv
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+from utils import available_cpus
 
 logger = logging.getLogger(__name__)
 
+# Read buffer used when iterating input lines, so each refill pulls a large block of inflated data
+READ_BUFFER_SIZE = 1 << 20
 
-def create_products_iteratively(fp_in, fp_out, pid_identifiers=None, vid_identifiers=None):
+# Number of input lines handed to a worker process per task
+CHUNK_SIZE = 5000
+
+# Number of input lines transformed and serialized together when running in a single process
+BATCH_SIZE = 1024
+
+# Identifier properties used when none are supplied; `id` should always be present on Shopify objects
+DEFAULT_IDENTIFIERS: Tuple[str, ...] = ("id",)
+
+# Attribute and metafield attribute prefixes for the product and variant namespaces
+ATTRIBUTE_PREFIXES: Dict[str, Tuple[str, str]] = {
+  "sp": ("sp.", "spm."),
+  "sv": ("sv.", "svm."),
+}
+
+# Identifiers bound once per worker process by _init_worker, so they aren't pickled with every chunk
+_worker_pid_identifiers: Tuple[str, ...] = DEFAULT_IDENTIFIERS
+_worker_vid_identifiers: Tuple[str, ...] = DEFAULT_IDENTIFIERS
+
+
+def parse_identifiers(identifiers: Optional[str]) -> Tuple[str, ...]:
+  """
+  Parse a comma-separated list of identifier properties once per run.
+
+  Args:
+      identifiers: Comma-separated identifier property names, or None
+
+  Returns:
+      tuple: Identifier property names to try, in order
+  """
+  if identifiers is None:
+    return DEFAULT_IDENTIFIERS
+  return tuple(identifiers.split(","))
+
+
+def _init_worker(pid_identifiers: Tuple[str, ...], vid_identifiers: Tuple[str, ...]) -> None:
+  global _worker_pid_identifiers, _worker_vid_identifiers
+  _worker_pid_identifiers = pid_identifiers
+  _worker_vid_identifiers = vid_identifiers
+
+
+def transform_lines(lines: List[bytes],
+                    pid_identifiers: Tuple[str, ...] = DEFAULT_IDENTIFIERS,
+                    vid_identifiers: Tuple[str, ...] = DEFAULT_IDENTIFIERS) -> Tuple[bytes, int]:
+  """
+  Transform a batch of raw JSONL lines into serialized Bloomreach products.
+
+  Args:
+      lines: List of raw Shopify product lines (bytes)
+      pid_identifiers: Product identifier properties (tuple, see parse_identifiers)
+      vid_identifiers: Variant identifier properties (tuple, see parse_identifiers)
+
+  Returns:
+      tuple: (serialized JSONL bytes, number of products transformed)
+  """
+  serialized: List[bytes] = []
+  for line in lines:
+    try:
+      product = create_product(orjson.loads(line), pid_identifiers, vid_identifiers)
+      serialized.append(orjson.dumps(product))
+    except Exception as e:
+      # Log error but continue processing
+      logger.error(f"Error processing product: {str(e)}")
+
+  if not serialized:
+    return b'', 0
+  serialized.append(b'')
+  return b'\n'.join(serialized), len(serialized) - 1
+
+
+def _transform_chunk(lines: List[bytes]) -> Tuple[bytes, int]:
+  return transform_lines(lines, _worker_pid_identifiers, _worker_vid_identifiers)
+
+
+def create_products_iteratively(fp_in, fp_out, pid_identifiers=None, vid_identifiers=None, workers=None):
   """
   Memory-efficient version that processes one product at a time and writes directly to output.
   Does not store all products in memory.
 
+  When more than one worker is requested, chunks of input lines are transformed in a process pool
+  and written back in input order. Only a bounded number of chunks is in flight at any time.
+
   Args:
       fp_in: Input file path (gzipped JSONL)
       fp_out: Output file path (gzipped JSONL)
       pid_identifiers: Product identifier property names (comma-separated string)
       vid_identifiers: Variant identifier property names (comma-separated string)
+      workers: Number of worker processes, defaults to the CPUs available to the container
 
   Returns:
       int: Number of products processed
   """
   product_count = 0
+  if workers is None:
+    workers = available_cpus()
+
+  # Identifier lists are constant for the whole run, so split them once rather than per product and variant
+  pid_identifiers = parse_identifiers(pid_identifiers)
+  vid_identifiers = parse_identifiers(vid_identifiers)
+
+  # Process one line at a time and write directly to output.
+  # ISA-L backed gzip is used on both sides; the output is an intermediate file, so favour speed over ratio.
+  with io.BufferedReader(igzip.open(fp_in, 'rb'), buffer_size=READ_BUFFER_SIZE) as file_in, \
+       igzip.open(fp_out, 'wb', compresslevel=1) as file_out:
+    if workers > 1:
+      chunks = iter(lambda: list(islice(file_in, CHUNK_SIZE)), [])
+      with ProcessPoolExecutor(max_workers=workers,
+                               initializer=_init_worker,
+                               initargs=(pid_identifiers, vid_identifiers)) as pool:
+        pending = deque()
+        for chunk in chunks:
+          pending.append(pool.submit(_transform_chunk, chunk))
+          # Keep every worker busy without reading the whole input ahead of the writer
+          if len(pending) < workers * 2:
+            continue
+          serialized, count = pending.popleft().result()
+          file_out.write(serialized)
+          product_count += count
+          logger.info(f"Processed {product_count} products")
 
-  # Process one line at a time and write directly to output
-  with gzip.open(fp_in, 'rb') as file_in, gzip.open(fp_out, 'wb') as file_out:
-    writer = jsonlines.Writer(file_out)
-
-    for line in file_in:
-      # Process each product individually
-      try:
-        shopify_product = json.loads(line)
-        product = create_product(shopify_product, pid_identifiers, vid_identifiers)
-        writer.write(product)
-        product_count += 1
-
-        # Log progress for every 100 products
-        if product_count % 100 == 0:
+        while pending:
+          serialized, count = pending.popleft().result()
+          file_out.write(serialized)
+          product_count += count
           logger.info(f"Processed {product_count} products")
 
-      except Exception as e:
-        # Log error but continue processing
-        logger.error(f"Error processing product: {str(e)}")
+      logger.info(f"Finished processing {product_count} products")
+      return product_count
 
-    writer.close()
+    # Transform and serialize a batch of lines at a time, handing each batch to the gzip writer in one write
+    for batch in iter(lambda: list(islice(file_in, BATCH_SIZE)), []):
+      serialized, count = transform_lines(batch, pid_identifiers, vid_identifiers)
+      file_out.write(serialized)
+      product_count += count
+      logger.info(f"Processed {product_count} products")
 
   logger.info(f"Finished processing {product_count} products")
   return product_count
 
 
+def process(products, pid_identifiers=None, vid_identifiers=None):
+  """
+  Generator form of this stage: yields Bloomreach products for already parsed Shopify products.
+
+  Args:
+      products: Iterable of aggregated Shopify product dicts
+      pid_identifiers: Product identifier property names (comma-separated string)
+      vid_identifiers: Variant identifier property names (comma-separated string)
+  """
+  return transform_products(products, parse_identifiers(pid_identifiers), parse_identifiers(vid_identifiers))
+
+
+def transform_products(products: Iterable[Dict[str, Any]],
+                       pid_identifiers: Tuple[str, ...],
+                       vid_identifiers: Tuple[str, ...]) -> Iterator[Dict[str, Any]]:
+  """
+  Like process, for identifiers already parsed with parse_identifiers, e.g. once per worker process.
+  """
+  for product in products:
+    try:
+      yield create_product(product, pid_identifiers, vid_identifiers)
+    except Exception as e:
+      # Log error but continue processing
+      logger.error(f"Error processing product: {str(e)}")
+
+
 # Legacy function - kept for backward compatibility
 def create_products(fp, pid_identifiers=None, vid_identifiers=None):
   """
@@ -58,6 +191,8 @@ def create_products(fp, pid_identifiers=None, vid_identifiers=None):
   """
   logger.warning("Using memory-intensive create_products. Consider switching to create_products_iteratively.")
   products = []
+  pid_identifiers = parse_identifiers(pid_identifiers)
+  vid_identifiers = parse_identifiers(vid_identifiers)
 
   # stream over file and index each object in bulk output
   with gzip.open(fp, 'rb') as file:
@@ -67,14 +202,16 @@ def create_products(fp, pid_identifiers=None, vid_identifiers=None):
   return products
 
 
-def create_product(shopify_product, pid_identifiers=None, vid_identifiers=None):
+def create_product(shopify_product: Dict[str, Any],
+                   pid_identifiers: Tuple[str, ...] = DEFAULT_IDENTIFIERS,
+                   vid_identifiers: Tuple[str, ...] = DEFAULT_IDENTIFIERS) -> Dict[str, Any]:
   """
   Create a Bloomreach product from a Shopify product.
 
   Args:
       shopify_product: Shopify product data
-      pid_identifiers: Product identifier properties
-      vid_identifiers: Variant identifier properties
+      pid_identifiers: Product identifier properties (tuple, see parse_identifiers)
+      vid_identifiers: Variant identifier properties (tuple, see parse_identifiers)
 
   Returns:
       dict: Bloomreach product structure
@@ -86,36 +223,28 @@ def create_product(shopify_product, pid_identifiers=None, vid_identifiers=None):
   }
 
 
-def create_id(shopify_object, identifiers=None):
+def create_id(shopify_object: Dict[str, Any], identifiers: Tuple[str, ...] = DEFAULT_IDENTIFIERS) -> Any:
   """
   Create an ID for a Shopify object.
 
   Args:
       shopify_object: Shopify object data
-      identifiers: Comma-separated list of identifier properties to try
+      identifiers: Tuple of identifier properties to try, in order
 
   Returns:
       str: ID value
   """
-  id = "NOIDENTIFIERFOUND"
-  # setup default identifiers based on common Shopify patterns
-  if identifiers is None:
-    identifiers = ["id"]
-  else:
-    identifiers = identifiers.split(",")
-
+  # Return the first identifier with a value; most objects match on the first one tried
   for identifier in identifiers:
-    if identifier in shopify_object and shopify_object[identifier]:
-      id = shopify_object[identifier]
-      break
-    elif "id" in shopify_object:
-      # If `id` isn't supplied as custom identifier, use `id` as it should always be present
-      id = shopify_object["id"]
+    id = shopify_object.get(identifier)
+    if id:
+      return id
 
-  return id
+  # If `id` isn't supplied as custom identifier, use `id` as it should always be present
+  return shopify_object.get("id", "NOIDENTIFIERFOUND")
 
 
-def create_variants(shopify_product, identifiers=None):
+def create_variants(shopify_product: Dict[str, Any], identifiers: Tuple[str, ...] = DEFAULT_IDENTIFIERS) -> Dict[str, Any]:
   """
   Create variants for a Bloomreach product.
 
@@ -126,15 +255,16 @@ def create_variants(shopify_product, identifiers=None):
   Returns:
       dict: Variants map
   """
-  variants = {}
-  if "variants" in shopify_product and shopify_product["variants"]:
-    for variant in shopify_product["variants"]:
-      variant = create_variant(variant, identifiers)
-      variants[variant["id"]] = {"attributes": variant["attributes"]}
-  return variants
+  shopify_variants = shopify_product.get("variants")
+  if not shopify_variants:
+    return {}
+  return {
+    variant["id"]: {"attributes": variant["attributes"]}
+    for variant in (create_variant(shopify_variant, identifiers) for shopify_variant in shopify_variants)
+  }
 
 
-def create_variant(shopify_variant, identifiers=None):
+def create_variant(shopify_variant: Dict[str, Any], identifiers: Tuple[str, ...] = DEFAULT_IDENTIFIERS) -> Dict[str, Any]:
   """
   Create a Bloomreach variant from a Shopify variant.
 
@@ -151,7 +281,7 @@ def create_variant(shopify_variant, identifiers=None):
   }
 
 
-def create_attributes(shopify_object, namespace):
+def create_attributes(shopify_object: Dict[str, Any], namespace: str) -> Dict[str, Any]:
   """
   Create attributes for a Bloomreach product or variant.
 
@@ -163,29 +293,33 @@ def create_attributes(shopify_object, namespace):
       dict: Attributes map
   """
   # TODO: Handle all the different types of metafield value types like arrays, etc
-  attributes = {}
+  attributes: Dict[str, Any] = {}
+  # prefixes for the known namespaces are built once per run rather than once per key
+  prefix, metafield_prefix = ATTRIBUTE_PREFIXES.get(namespace) or (namespace + ".", namespace + "m.")
   for k, v in shopify_object.items():
-    if "variants" in k:
+    # the aggregated Shopify object has a fixed set of nested keys, so compare them exactly
+    if k == "variants":
       continue
-    if "metafields" in k:
+    if k == "metafields":
       for metafield in v:
         # each metafield key/value added to attributes with namespace
-        attribute_name = namespace + "m." + metafield["namespace"] + "." + metafield["key"]
+        attribute_name = f"{metafield_prefix}{metafield['namespace']}.{metafield['key']}"
         # This is a hacky way of doing this to cover all the list use cases
         # however, more robust value type mapping should occur based on metafield["type"]
-        if "list" in metafield["type"]:
+        # Shopify list types are all of the form `list.<type>`
+        if metafield["type"].startswith("list"):
           attributes[attribute_name] = json.loads(metafield["value"])
         else:
           attributes[attribute_name] = metafield["value"]
-    elif "collections" in k:
+    elif k == "collections":
       attributes["category_paths"] = create_category_paths(v)
     else:
       # each object property added as attribute with namespace
-      attributes[namespace + "." + k] = v
+      attributes[prefix + k] = v
   return attributes
 
 
-def create_category_paths(collections):
+def create_category_paths(collections: List[Dict[str, Any]]) -> List[List[Dict[str, Any]]]:
   """
   Create category paths from collections.
 
@@ -195,14 +329,14 @@ def create_category_paths(collections):
   Returns:
       list: Category paths
   """
-  paths = []
+  paths: List[List[Dict[str, Any]]] = []
   for collection in collections:
     paths.append([{"id": collection["handle"], "name": collection["title"]}])
 
   return paths
 
 
-def main(fp_in, fp_out, pid_props, vid_props):
+def main(fp_in, fp_out, pid_props, vid_props, workers=None):
   """
   Main function - uses the memory-efficient processing method.
 
@@ -211,13 +345,15 @@ def main(fp_in, fp_out, pid_props, vid_props):
       fp_out: Output file path
       pid_props: Product identifier properties
       vid_props: Variant identifier properties
+      workers: Number of worker processes, defaults to the CPUs available to the container
   """
   logger.info(f"Starting iterative processing from {fp_in} to {fp_out}")
 
   # Process products iteratively without loading all into memory
   product_count = create_products_iteratively(fp_in, fp_out,
                                               pid_identifiers=pid_props,
-                                              vid_identifiers=vid_props)
+                                              vid_identifiers=vid_props,
+                                              workers=workers)
 
   logger.info(f"Successfully processed {product_count} products from {fp_in} to {fp_out}")
 
@@ -278,22 +414,30 @@ if __name__ == '__main__':
     default=False
   )
 
+  parser.add_argument(
+    "--workers",
+    help="Number of worker processes used to transform products. Defaults to the CPUs available to the container.",
+    type=int,
+    default=None,
+    required=False
+  )
+
   args = parser.parse_args()
   fp_in = args.input_file
   fp_out = args.output_file
   pid_props = args.pid_props
   vid_props = args.vid_props
+  workers = args.workers
 
   if args.legacy_mode:
     logger.warning("Using legacy mode with memory-intensive processing. Not recommended for large files.")
     products = create_products(fp_in, pid_identifiers=pid_props, vid_identifiers=vid_props)
 
     with gzip.open(fp_out, 'wb') as out:
-      writer = jsonlines.Writer(out)
       for product in products:
-        writer.write(product)
-      writer.close()
+        out.write(orjson.dumps(product))
+        out.write(b'\n')
 
     logger.info(f"Successfully processed {len(products)} products in legacy mode")
   else:
-    main(fp_in, fp_out, pid_props, vid_props)
\ No newline at end of file
+    main(fp_in, fp_out, pid_props, vid_props, workers)
\ No newline at end of file
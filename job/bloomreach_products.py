@@ -1,20 +1,50 @@
+import functools
+import io
 import logging
-import gzip
-import json
-import jsonlines
-import re
+import multiprocessing
+import orjson
+import rapidgzip
 import unicodedata
 from os import getenv
-from collections import defaultdict
+from collections import defaultdict, deque
+from concurrent.futures import ProcessPoolExecutor
+from isal import igzip
+from itertools import islice
+from utils import available_cpus
 
 logger = logging.getLogger(__name__)
 
+# Number of input lines handed to a worker process per task
+CHUNK_SIZE = 1000
+
+# Read buffer used when iterating input lines, so each refill pulls a large block of inflated data
+READ_BUFFER_SIZE = 1 << 20
+
+# Serialized output is accumulated up to this size before being handed to the gzip writer
+WRITE_BUFFER_SIZE = 1 << 20
+
+# Raw markers of the market data rows load_market_data uses; any other row is skipped before parsing
+PRODUCT_GID_MARKER = b'gid://shopify/Product/'
+MARKET_GID_MARKER = b'gid://shopify/Market/'
+ROOT_URLS_MARKER = b'"rootUrls"'
+
+# Run options bound once per worker process by _init_worker, so market data isn't pickled with every chunk
+_worker_options = None
+
 PRODUCT_MAPPINGS = [
   ["sp.vendor", "brand", lambda x: x],
   ["sp.descriptionHtml", "description", lambda x: x.strip()],
   ["sp.title", "title", lambda x: x]
 ]
 
+# Translation table used by normalize_key: every ASCII character other than a letter, digit or
+# whitespace becomes an underscore, and so do spaces
+NORMALIZE_KEY_TABLE = str.maketrans({
+  c: '_' for c in map(chr, range(128)) if c == ' ' or not (c.isalnum() or c.isspace())
+})
+
+# Attribute keys come from a small set of Shopify field names, so normalized keys are memoized
+@functools.lru_cache(maxsize=4096)
 def normalize_key(key):
   """
   Normalize key to match Bloomreach requirements:
@@ -24,17 +54,18 @@ def normalize_key(key):
   - Convert unsupported chars to underscore
   - Remove multiple consecutive underscores
   """
-  # First, de-accentize the string
-  normalized = unicodedata.normalize('NFKD', key).encode('ASCII', 'ignore').decode('ASCII')
-
-  # Replace any non-alphanumeric characters with underscore
-  normalized = re.sub(r'[^a-zA-Z0-9\s]', '_', normalized)
+  # First, de-accentize the string; ASCII keys (nearly all Shopify field names) are unchanged by NFKD
+  if key.isascii():
+    normalized = key
+  else:
+    normalized = unicodedata.normalize('NFKD', key).encode('ASCII', 'ignore').decode('ASCII')
 
-  # Replace spaces with underscore
-  normalized = normalized.replace(' ', '_')
+  # Replace any non-alphanumeric characters and spaces with underscore
+  normalized = normalized.translate(NORMALIZE_KEY_TABLE)
 
   # Remove multiple consecutive underscores
-  normalized = re.sub(r'_+', '_', normalized)
+  while '__' in normalized:
+    normalized = normalized.replace('__', '_')
 
   # Remove leading/trailing underscores
   normalized = normalized.strip('_')
@@ -49,6 +80,16 @@ def normalize_key(key):
 
   return normalized
 
+# Normalized forms of the keys used in create_product, computed once at import
+NORMALIZED_PRODUCT_MAPPINGS = [
+  (normalize_key(source), normalize_key(dest), func) for source, dest, func in PRODUCT_MAPPINGS
+]
+FEATURED_IMAGE_KEY = normalize_key("sp.featuredImage.url")
+COMPARE_PRICE_KEY = normalize_key("sv.compareAtPrice")
+PRICE_KEY = normalize_key("sv.price")
+IMAGE_URL_KEY = normalize_key("sv.image.url")
+AVAILABLE_KEY = normalize_key("sv.availableForSale")
+
 def is_empty_value(value):
   """Check if a value should be considered empty."""
   if value is None:
@@ -68,124 +109,182 @@ def extract_id_from_gid(gid):
       return gid
   return gid
 
+@functools.lru_cache(maxsize=8192)
+def _string_to_float(value):
+  try:
+    return float(value)
+  except ValueError:
+    return None
+
 def convert_to_float(value):
   """Convert string price to float, handling None values."""
   if value is None:
     return None
+  if isinstance(value, float):
+    return value
+  # Price strings repeat a lot across products and variants, so their parsed values are memoized
+  if isinstance(value, str):
+    return _string_to_float(value)
   try:
     return float(value)
   except (ValueError, TypeError):
     return None
 
-def flatten_dict(d, parent_key='', sep='_'):
-  items = []
-  for k, v in d.items():
-    new_key = f"{parent_key}{sep}{k}" if parent_key else k
-    new_key = normalize_key(new_key)
-
-    if isinstance(v, dict):
-      flattened = flatten_dict(v, new_key, sep=sep)
-      # Only add non-empty flattened values
-      items.extend((normalize_key(key), value) for key, value in flattened.items()
-                   if not is_empty_value(value))
-    elif isinstance(v, list):
-      if len(v) > 0 and isinstance(v[0], dict):
-        # Create a dictionary to hold grouped values
-        grouped_values = defaultdict(list)
-        for item in v:
-          if isinstance(item, dict):
-            for field_key, field_value in item.items():
-              if not is_empty_value(field_value):
+def flatten_dict(d, parent_key='', sep='_', out=None):
+  """
+  Flatten nested attributes into a single level of normalized keys, dropping empty values.
+  Nested dicts are walked with an explicit stack of iterators rather than recursion, so keys keep
+  the order they would have had in a depth-first walk and each key is normalized exactly once.
+  Attributes are written into out when given, otherwise into a new dict, which is returned.
+  """
+  items = {} if out is None else out
+  stack = [(iter(d.items()), parent_key)]
+  while stack:
+    iterator, prefix = stack[-1]
+    for k, v in iterator:
+      new_key = normalize_key(f"{prefix}{sep}{k}" if prefix else k)
+
+      if isinstance(v, dict):
+        # Descend now, and resume this level once the nested dict is exhausted
+        stack.append((iter(v.items()), new_key))
+        break
+      elif isinstance(v, list):
+        if len(v) > 0 and isinstance(v[0], dict):
+          # Create a dictionary to hold grouped values
+          grouped_values = defaultdict(list)
+          for item in v:
+            if isinstance(item, dict):
+              for field_key, field_value in item.items():
+                # is_empty_value, inlined for this hot path
+                if field_value is None or (isinstance(field_value, str) and not field_value.strip()) \
+                    or (isinstance(field_value, (list, dict)) and not field_value):
+                  continue
                 grouped_values[field_key].append(field_value)
 
-        # Add each grouped array to items if not empty
-        for field_key, field_values in grouped_values.items():
-          if field_values:  # Only add if the array is not empty
-            normalized_key = normalize_key(f"{new_key}_{field_key}")
-            items.append((normalized_key, field_values))
-      elif v:  # Only add non-empty arrays
-        items.append((new_key, v))
+          # Add each grouped array to items if not empty
+          for field_key, field_values in grouped_values.items():
+            if field_values:  # Only add if the array is not empty
+              items[normalize_key(f"{new_key}_{field_key}")] = field_values
+        elif v:  # Only add non-empty arrays
+          items[new_key] = v
+      else:
+        # Convert price-related fields to float
+        if isinstance(v, str) and ('amount' in new_key or 'price' in new_key):
+          v = convert_to_float(v)
+
+        # Only add non-empty values; lists and dicts were handled above, so this is is_empty_value inlined
+        if v is not None and not (isinstance(v, str) and not v.strip()):
+          items[new_key] = v
     else:
-      # Convert price-related fields to float
-      if isinstance(v, str) and any(price_key in new_key for price_key in ['amount', 'price']):
-        v = convert_to_float(v)
+      # This level is exhausted
+      stack.pop()
+
+  return items
+
+def open_gzip_reader(fp):
+  """
+  Open a gzipped file for line iteration, decompressing it with rapidgzip across the available CPUs.
+  """
+  return io.BufferedReader(rapidgzip.open(fp, parallelization=available_cpus()), buffer_size=READ_BUFFER_SIZE)
 
-      # Only add non-empty values
-      if not is_empty_value(v):
-        items.append((new_key, v))
+def _init_worker(shopify_url, market_data, shopify_market, shopify_language):
+  global _worker_options
+  _worker_options = (shopify_url, market_data, shopify_market, shopify_language)
 
-  return dict(items)
+def _transform_chunk(lines):
+  return [transform_product(orjson.loads(line), *_worker_options) for line in lines]
+
+def transform_product(generic_product, shopify_url, market_data=None, shopify_market=None, shopify_language=None):
+  """
+  Create a Bloomreach product from a generic product and merge in its market data, if any.
+  """
+  product = create_product(generic_product, shopify_url)
+
+  # If we have market data, try to merge it
+  if market_data is not None:
+    # Get the full GID format product ID
+    product_id = product['attributes'].get('sp_id')
+    if product_id and product_id in market_data:
+      # Extract market data
+      markets_info = market_data[product_id]['markets']
+
+      # Create arrays of market names and handles
+      product['attributes']['sp_markets'] = [market['name'] for market in markets_info]
+      product['attributes']['sp_markets_handle'] = [market['handle'] for market in markets_info]
+
+      # Add URL attributes for each market/locale combination, from names and prefixes built per market
+      product_handle = product['attributes'].get('sp_handle')
+      if product_handle:
+        for market in markets_info:
+          for attr_name, url_prefix in market['url_attributes']:
+            product['attributes'][attr_name] = url_prefix + product_handle
+
+      # If specific market and language are provided, update the main URL
+      if shopify_market and shopify_language:
+        for market in markets_info:
+          if market['handle'] == shopify_market:
+            url_prefix = market['product_url_prefixes'].get(shopify_language)
+            if url_prefix:
+              product['attributes']['url'] = f"{url_prefix}{product_handle}"
+
+      logger.debug(f"Added market data for product {product_id}")
+    else:
+      logger.debug(f"No market data found for product {product_id}")
 
-def clean_attributes(attrs):
-  """Remove empty values from attributes dictionary and normalize keys."""
-  return {normalize_key(k): v for k, v in attrs.items() if not is_empty_value(v)}
+  return product
 
-def create_products(fp, shopify_url, market_data=None, shopify_market=None, shopify_language=None):
+def create_products(fp, shopify_url, market_data=None, shopify_market=None, shopify_language=None, workers=None):
   """
   Modified create_products function that incorporates market data in the required format.
   Also uses specific market and language when provided to set the base URL.
+
+  Products are yielded as they are transformed rather than collected, so memory use doesn't grow
+  with the size of the catalog. When more than one worker is requested, chunks of input lines are
+  transformed in a process pool and yielded in input order. Only a bounded number of chunks is in
+  flight at any time. Workers are started by a forkserver, as the reader's decompression threads are
+  already running when the pool starts.
   """
-  products = []
+  if workers is None:
+    workers = available_cpus()
+
+  with open_gzip_reader(fp) as file:
+    if workers > 1:
+      chunks = iter(lambda: list(islice(file, CHUNK_SIZE)), [])
+      with ProcessPoolExecutor(max_workers=workers,
+                               mp_context=multiprocessing.get_context("forkserver"),
+                               initializer=_init_worker,
+                               initargs=(shopify_url, market_data, shopify_market, shopify_language)) as pool:
+        pending = deque()
+        for chunk in chunks:
+          pending.append(pool.submit(_transform_chunk, chunk))
+          # Keep every worker busy without reading the whole input ahead of the consumer
+          if len(pending) >= workers * 2:
+            yield from pending.popleft().result()
+
+        while pending:
+          yield from pending.popleft().result()
+      return
 
-  with gzip.open(fp, 'rb') as file:
     for line in file:
-      product = create_product(json.loads(line), shopify_url)
-
-      # If we have market data, try to merge it
-      if market_data is not None:
-        # Get the full GID format product ID
-        product_id = product['attributes'].get('sp_id')
-        if product_id and product_id in market_data:
-          # Extract market data
-          markets_info = market_data[product_id]['markets']
-
-          # Create arrays of market names and handles
-          product['attributes']['sp_markets'] = [market['name'] for market in markets_info]
-          product['attributes']['sp_markets_handle'] = [market['handle'] for market in markets_info]
-
-          # Add URL attributes for each market/locale combination
-          product_handle = product['attributes'].get('sp_handle')
-          if product_handle:
-            for market in markets_info:
-              market_handle = market['handle']
-              if 'rootUrls' in market:
-                for root_url in market['rootUrls']:
-                  locale = root_url.get('locale')
-                  url = root_url.get('url')
-                  if locale and url:
-                    # Create the attribute with the specified format
-                    attr_name = f"sp_market_{market_handle}_{locale}_url"
-                    product['attributes'][attr_name] = f"{url}products/{product_handle}"
-
-          # If specific market and language are provided, update the main URL
-          if shopify_market and shopify_language:
-            for market in markets_info:
-              if market['handle'] == shopify_market and 'rootUrls' in market:
-                for root_url in market['rootUrls']:
-                  if root_url.get('locale') == shopify_language:
-                    base_url = root_url.get('url', '').rstrip('/')
-                    if base_url:
-                      product['attributes']['url'] = f"{base_url}/products/{product_handle}"
-                      break
-
-          logger.debug(f"Added market data for product {product_id}")
-        else:
-          logger.debug(f"No market data found for product {product_id}")
-
-      products.append(product)
-
-  return products
+      yield transform_product(orjson.loads(line), shopify_url, market_data, shopify_market, shopify_language)
+
+def process(generic_products, shopify_url, market_data=None, shopify_market=None, shopify_language=None):
+  """
+  Generator form of this stage: yields Bloomreach products for already parsed generic products.
+  """
+  for generic_product in generic_products:
+    yield transform_product(generic_product, shopify_url, market_data, shopify_market, shopify_language)
 
 def create_product(product, shopify_url):
   out_product = {
     "id": product["id"],
-    "attributes": product["attributes"].copy(),
+    "attributes": {},
     "variants": {}
   }
 
-  # Flatten all attributes at the product level
-  flattened_attributes = flatten_dict(out_product["attributes"])
-  out_product["attributes"] = flattened_attributes
+  # Flatten all attributes at the product level straight into the output product; flatten_dict
+  # never modifies its input and already drops empty values, so no copy or final cleanup is needed
+  flatten_dict(product["attributes"], out=out_product["attributes"])
 
   # container for input product attributes
   in_pa = product["attributes"]
@@ -203,18 +302,15 @@ def create_product(product, shopify_url):
     out_pa["availability"] = False
 
   # Set thumb_image from featured image
-  featured_image_key = normalize_key("sp.featuredImage.url")
-  if featured_image_key in out_pa:
-    out_pa["thumb_image"] = out_pa[featured_image_key]
+  if FEATURED_IMAGE_KEY in out_pa:
+    out_pa["thumb_image"] = out_pa[FEATURED_IMAGE_KEY]
 
   # Process product level mappings
-  for mapping in PRODUCT_MAPPINGS:
-    source, dest, func = mapping[0], mapping[1], mapping[2]
-    normalized_source = normalize_key(source)
-    if normalized_source in out_pa:
-      value = func(out_pa[normalized_source])
+  for source, dest, func in NORMALIZED_PRODUCT_MAPPINGS:
+    if source in out_pa:
+      value = func(out_pa[source])
       if not is_empty_value(value):
-        out_pa[normalize_key(dest)] = value
+        out_pa[dest] = value
 
   # Process variants
   if "variants" in product and product["variants"]:
@@ -239,45 +335,33 @@ def create_product(product, shopify_url):
       # Handle variant-specific logic
       variant_attrs = processed_variants[variant_key]["attributes"]
 
-      # Price handling with float conversion
-      compare_price_key = normalize_key("sv.compareAtPrice")
-      price_key = normalize_key("sv.price")
+      # Bound once, since the same variant is looked up several times below
+      get = variant_attrs.get
 
-      if compare_price_key in variant_attrs and variant_attrs[compare_price_key]:
-        compare_price = convert_to_float(variant_attrs[compare_price_key])
-        variant_price = convert_to_float(variant_attrs[price_key])
+      # Price handling with float conversion
+      compare_at_price = get(COMPARE_PRICE_KEY)
+      if compare_at_price:
+        compare_price = convert_to_float(compare_at_price)
+        variant_price = convert_to_float(variant_attrs[PRICE_KEY])
 
         if compare_price and variant_price:  # Only process if both prices are valid
-          if compare_price == variant_price:
-            variant_attrs["price"] = compare_price
-          else:
-            variant_attrs["price"] = compare_price
+          variant_attrs["price"] = compare_price
+          if compare_price != variant_price:
             variant_attrs["sale_price"] = variant_price
-      elif price_key in variant_attrs:
-        price = convert_to_float(variant_attrs[price_key])
+      elif PRICE_KEY in variant_attrs:
+        price = convert_to_float(variant_attrs[PRICE_KEY])
         if price:  # Only add if price is valid
           variant_attrs["price"] = price
 
       # Set thumb_image for variant
-      image_url_key = normalize_key("sv.image.url")
-      if image_url_key in variant_attrs:
-        variant_attrs["thumb_image"] = variant_attrs[image_url_key]
+      if IMAGE_URL_KEY in variant_attrs:
+        variant_attrs["thumb_image"] = variant_attrs[IMAGE_URL_KEY]
 
       # Availability
-      available_key = normalize_key("sv.availableForSale")
-      variant_attrs["availability"] = False
-      if available_key in variant_attrs and variant_attrs[available_key]:
-        variant_attrs["availability"] = True
-
-      # Clean empty values from variant attributes
-      variant_attrs = clean_attributes(variant_attrs)
-      if not variant_attrs:  # Skip variant if no attributes remain
-        continue
-      processed_variants[variant_key]["attributes"] = variant_attrs
+      variant_attrs["availability"] = bool(get(AVAILABLE_KEY))
 
-    # Only add non-empty variants
-    out_product["variants"] = {k: v for k, v in processed_variants.items()
-                               if v["attributes"]}
+    # Variants without attributes were skipped above, and the rest always carry availability
+    out_product["variants"] = processed_variants
 
     # Set root level price range if available
     min_price = None
@@ -295,11 +379,40 @@ def create_product(product, shopify_url):
     if max_price is not None and max_price != min_price:
       out_pa["price_range_max"] = max_price
 
-  # Final cleanup of product attributes
-  out_product["attributes"] = clean_attributes(out_pa)
-
   return out_product
 
+def create_market_entry(market_info, urls_by_market):
+  """
+  Build the market entry shared by every product in a market's publication. Alongside the market's
+  handle, name and rootUrls, it carries the per-locale URL attribute names and product URL prefixes,
+  so they are formatted once per market rather than once per product.
+  """
+  market_handle = market_info["handle"]
+  market_data = {
+    "handle": market_handle,
+    "name": market_info["name"],
+    "url_attributes": [],
+    "product_url_prefixes": {}
+  }
+
+  # Add rootUrls if available
+  urls = urls_by_market.get(market_info["id"])
+  if urls:
+    market_data["rootUrls"] = urls
+    for root_url in urls:
+      locale = root_url.get('locale')
+      url = root_url.get('url')
+      if locale and url:
+        # Create the attribute with the specified format
+        market_data["url_attributes"].append((f"sp_market_{market_handle}_{locale}_url", f"{url}products/"))
+
+      # The first non-empty URL for a locale is used as the product's main URL
+      base_url = (url or '').rstrip('/')
+      if base_url and locale not in market_data["product_url_prefixes"]:
+        market_data["product_url_prefixes"][locale] = f"{base_url}/products/"
+
+  return market_data
+
 def load_market_data(input_file):
   """
   Load and process market data from the JSONL file.
@@ -310,13 +423,25 @@ def load_market_data(input_file):
   urls_by_market = {}
 
   try:
-    # First pass: collect all markets and URLs
-    with gzip.open(input_file, 'r') as file:
+    # Single pass: collect all markets and URLs, and queue up product entries, since a product
+    # may be read before the market and URLs it will be resolved against
+    pending_products = []
+    with open_gzip_reader(input_file) as file:
       for line in file:
-        data = json.loads(line.strip())
+        # Classify each row from its raw bytes, testing for products first since they make up most of
+        # the export; publication rows are never needed, so they are skipped without being parsed
+        if PRODUCT_GID_MARKER not in line and MARKET_GID_MARKER not in line and ROOT_URLS_MARKER not in line:
+          continue
+
+        data = orjson.loads(line)
+        object_id = data.get("id", "")
+
+        # Handle product entries
+        if object_id.startswith("gid://shopify/Product/"):
+          pending_products.append((object_id, data["__parentId"], data["handle"], data.get("title", "")))
 
         # Handle market entries
-        if data.get("id", "").startswith("gid://shopify/Market/"):
+        elif object_id.startswith("gid://shopify/Market/"):
           markets_by_publication[data["__parentId"]] = {
             "id": data["id"],
             "handle": data["handle"],
@@ -327,37 +452,23 @@ def load_market_data(input_file):
         elif "rootUrls" in data:
           urls_by_market[data["__parentId"]] = data["rootUrls"]
 
-    # Second pass: process products
-    with gzip.open(input_file, 'r') as file:
-      for line in file:
-        data = json.loads(line.strip())
-
-        # Handle product entries
-        if data.get("id", "").startswith("gid://shopify/Product/"):
-          product_id = data["id"]
-          publication_id = data["__parentId"]
-
-          # Update basic product info
-          products[product_id]["handle"] = data["handle"]
-          products[product_id]["title"] = data.get("title", "")
-
-          # Get market info for this publication
-          market_info = markets_by_publication.get(publication_id)
-          if market_info:
-            market_id = market_info["id"]
-            market_data = {
-              "handle": market_info["handle"],
-              "name": market_info["name"]
-            }
-
-            # Add rootUrls if available
-            urls = urls_by_market.get(market_id)
-            if urls:
-              market_data["rootUrls"] = urls
-
-            # Check if we already have this market
-            if not any(m["handle"] == market_data["handle"] for m in products[product_id]["markets"]):
-              products[product_id]["markets"].append(market_data)
+    # Resolve products against the complete market and URL lookups; products in the same
+    # publication share one market entry
+    market_entries = {}
+    for product_id, publication_id, handle, title in pending_products:
+      # Update basic product info
+      products[product_id]["handle"] = handle
+      products[product_id]["title"] = title
+
+      # Get market info for this publication
+      market_data = market_entries.get(publication_id)
+      if market_data is None and publication_id in markets_by_publication:
+        market_data = market_entries[publication_id] = create_market_entry(
+          markets_by_publication[publication_id], urls_by_market)
+      if market_data:
+        # Check if we already have this market
+        if not any(m["handle"] == market_data["handle"] for m in products[product_id]["markets"]):
+          products[product_id]["markets"].append(market_data)
 
     # Create final result
     result = {}
@@ -373,17 +484,10 @@ def load_market_data(input_file):
     logger.error(f"Error processing market data: {str(e)}")
     raise
 
-def main(fp_in, fp_out, shopify_url, market_data_fp=None, shopify_market=None, shopify_language=None):
+def load_optional_market_data(market_data_fp=None):
   """
-  Modified main function that handles optional market data processing.
-
-  Args:
-      fp_in: Input file path for generic products
-      fp_out: Output file path for processed products
-      shopify_url: Shopify shop URL
-      market_data_fp: Optional file path for market data
+  Load market data if a file is provided, continuing without it if loading fails.
   """
-  # Load market data if provided
   market_data = None
   if market_data_fp:
     logger.info(f"Loading market data from {market_data_fp}")
@@ -393,18 +497,40 @@ def main(fp_in, fp_out, shopify_url, market_data_fp=None, shopify_market=None, s
       logger.error(f"Failed to load market data: {str(e)}")
       # Continue without market data if loading fails
       pass
+  return market_data
 
-  # Process products with optional market data
-  patch = create_products(fp_in, shopify_url, market_data, shopify_market, shopify_language)
+def main(fp_in, fp_out, shopify_url, market_data_fp=None, shopify_market=None, shopify_language=None, workers=None):
+  """
+  Modified main function that handles optional market data processing.
 
-  # Write processed products to output file
-  with gzip.open(fp_out, "wb") as file:
-    writer = jsonlines.Writer(file)
-    for object in patch:
-      writer.write(object)
-    writer.close()
+  Args:
+      fp_in: Input file path for generic products
+      fp_out: Output file path for processed products
+      shopify_url: Shopify shop URL
+      market_data_fp: Optional file path for market data
+      workers: Number of worker processes, defaults to the CPUs available to the container
+  """
+  market_data = load_optional_market_data(market_data_fp)
 
-  logger.info(f"Processed {len(patch)} products")
+  # Process products with optional market data
+  products = create_products(fp_in, shopify_url, market_data, shopify_market, shopify_language, workers)
+
+  # Write processed products to output file; ISA-L at level 1 favours speed over ratio
+  with igzip.open(fp_out, "wb", compresslevel=1) as file:
+    # Products are written as they are produced, so only the buffer is held in memory
+    product_count = 0
+    buffer = bytearray()
+    for object in products:
+      product_count += 1
+      buffer += orjson.dumps(object)
+      buffer += b'\n'
+      # Compress in large blocks rather than issuing two small writes per product
+      if len(buffer) >= WRITE_BUFFER_SIZE:
+        file.write(buffer)
+        buffer.clear()
+    file.write(buffer)
+
+  logger.info(f"Processed {product_count} products")
 
 if __name__ == '__main__':
   import argparse
@@ -454,10 +580,19 @@ if __name__ == '__main__':
     default=None
   )
 
+  parser.add_argument(
+    "--workers",
+    help="Number of worker processes used to transform products. Defaults to the CPUs available to the container.",
+    type=int,
+    default=None,
+    required=False
+  )
+
   args = parser.parse_args()
   fp_in = args.input_file
   fp_out = args.output_file
   shopify_url = args.shopify_url
   market_data_fp = args.market_data
+  workers = args.workers
 
-  main(fp_in, fp_out, shopify_url, market_data_fp)
\ No newline at end of file
+  main(fp_in, fp_out, shopify_url, market_data_fp, workers=workers)
\ No newline at end of file
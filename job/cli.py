@@ -0,0 +1,261 @@
+import argparse
+import os
+import re
+from dataclasses import dataclass
+from typing import Optional
+
+# Environment variables read by the command line entry points, looked up once at startup
+ENV = {k: os.environ.get(k) for k in (
+  "BR_SHOPIFY_URL",
+  "BR_SHOPIFY_PAT",
+  "BR_ENVIRONMENT_NAME",
+  "BR_ACCOUNT_ID",
+  "BR_CATALOG_NAME",
+  "BR_API_TOKEN",
+  "BR_OUTPUT_DIR",
+  "BR_MULTI_MARKET",
+  "BR_SAVE_INTERMEDIATE_FILES",
+  "BR_WORK_DIR",
+  "BR_WEBHOOK_URL",
+  "BR_WEBHOOK_PORT",
+  "BR_WEBHOOK_SECRET",
+  "SHOPIFY_URL",
+  "SHOPIFY_PAT",
+  "SHOPIFY_MARKET",
+  "SHOPIFY_LANGUAGE",
+  "AUTO_INDEX",
+  "DELTA_MODE",
+  "START_DATE",
+  "MARKET_CACHE_ENABLED",
+  "MARKET_CACHE_MAX_AGE_HOURS",
+  "PRODUCTS_CACHE_MAX_AGE_MINUTES",
+  "BR_BULK_SHARDS",
+  "BR_WORKERS",
+)}
+
+DESCRIPTION = (
+  "Extracts a full set of products and their categories from the shopify store and runs a full feed into a Bloomreach Discovery catalog.\n \n"
+  "Uses Shopify's GraphQL Bulk Operation API.\n \n"
+  "During processing, it will save the Shopify bulk operation output jsonl file locally named with the BulkOperation ID value.\n \n"
+  "From there, the file will run through different transforms to create a Bloomreach patch that is then run in full feed mode via the BR Feed API.\n \n"
+  "Each transform step will save its intermediate output locally as well for debugging purposes prefixed with a step number.\n \n"
+  "For example:\n"
+  "23453245234_0.jsonl\n"
+  "23453245234_1_shopify_products.jsonl\n"
+  "23453245234_2_generic_products.jsonl\n"
+  "23453245234_3_br_products.jsonl\n"
+  "23453245234_4_br_patch.jsonl"
+)
+
+# Values accepted for the Bloomreach environment, and the format of a Bloomreach account ID
+VALID_ENVIRONMENTS = ("staging", "production")
+ACCOUNT_ID_PATTERN = re.compile(r"\d{4}")
+
+def env_flag(name, default="false"):
+  """Whether an environment variable is set to `true`, case-insensitively."""
+  return (ENV.get(name) or default).lower() == "true"
+
+def add_env_argument(parser, flag, env_var, help):
+  """Add a string argument that defaults to an environment variable and is required when it isn't set."""
+  parser.add_argument(
+    flag,
+    help=help,
+    type=str,
+    default=ENV.get(env_var),
+    required=not ENV.get(env_var)
+  )
+
+def build_parser(include_feed_options=True):
+  """
+  Build the command line parser shared by main.py and graphql.py.
+
+  Args:
+      include_feed_options: Whether to add the Bloomreach and feed options used by the full job,
+          or only those needed to export the Shopify bulk files
+
+  Returns:
+      argparse.ArgumentParser: The parser
+  """
+  parser = argparse.ArgumentParser(description=DESCRIPTION)
+
+  parser.add_argument(
+    "--multi-market",
+    help="Enable multi-market product data export",
+    action="store_true",
+    default=False
+  )
+
+  add_env_argument(parser, "--shopify-url", "BR_SHOPIFY_URL",
+                   "Hostname of the shopify Shop, e.g. xyz.myshopify.com.")
+  add_env_argument(parser, "--shopify-pat", "BR_SHOPIFY_PAT",
+                   "Shopify PAT token, e.g shpat_casdcaewras82342dczasdf3")
+  add_env_argument(parser, "--output-dir", "BR_OUTPUT_DIR",
+                   "Directory path to store the output files to")
+
+  if not include_feed_options:
+    return parser
+
+  add_env_argument(parser, "--br-environment", "BR_ENVIRONMENT_NAME",
+                   "Which Bloomreach Account environment to send catalog data to")
+  add_env_argument(parser, "--br-account-id", "BR_ACCOUNT_ID",
+                   "Which Bloomreach Account ID to send catalog data to")
+  add_env_argument(parser, "--br-catalog-name", "BR_CATALOG_NAME",
+                   "Which Bloomreach Catalog Name to send catalog data to.\nThis is the same as the value of domain_key parameter in Search API requests.")
+  add_env_argument(parser, "--br-api-token", "BR_API_TOKEN",
+                   "The BR Feed API bearer token")
+
+  # New arguments for multi-market support
+  parser.add_argument(
+    "--shopify-market",
+    help="Shopify market code (required when --multi-market is used)",
+    type=str,
+    default=ENV.get("SHOPIFY_MARKET")
+  )
+
+  parser.add_argument(
+    "--shopify-language",
+    help="Shopify language code (required when --multi-market is used)",
+    type=str,
+    default=ENV.get("SHOPIFY_LANGUAGE")
+  )
+
+  parser.add_argument(
+    "--auto-index",
+    help="Automatically trigger index job after successful feed upload",
+    action="store_true",
+    default=False
+  )
+
+  parser.add_argument(
+    "--delta-mode",
+    help="Run in delta mode for incremental updates",
+    action="store_true",
+    default=False
+  )
+
+  parser.add_argument(
+    "--start-date",
+    help="Start date for delta mode (ISO format)",
+    type=str,
+    default=None
+  )
+
+  parser.add_argument(
+    "--market-cache-enabled",
+    help="Enable market data caching for delta feeds",
+    action="store_true",
+    default=False
+  )
+
+  parser.add_argument(
+    "--market-cache-max-age-hours",
+    help="Maximum age of market data cache in hours",
+    type=int,
+    default=24
+  )
+
+  parser.add_argument(
+    "--products-cache-max-age-minutes",
+    help="Reuse a Shopify products export downloaded for the same shop and query within this many minutes (0 disables reuse)",
+    type=int,
+    default=0
+  )
+
+  parser.add_argument(
+    "--bulk-shards",
+    help="Split the Shopify product export into this many concurrent bulk operations by product creation date (at most 5, needs API version 2026-01)",
+    type=int,
+    default=1
+  )
+
+  parser.add_argument(
+    "--workers",
+    help="Number of worker processes transforming products, defaults to the number of CPUs available to the job, including any container CPU limit (1 transforms them in the main process)",
+    type=int,
+    default=None
+  )
+
+  return parser
+
+@dataclass(frozen=True)
+class Config:
+  """
+  Settings of a run of the full job, read once from the command line and environment
+  and validated when created, so the rest of the job can rely on them.
+  """
+  shopify_url: str
+  shopify_pat: str
+  br_account_id: str
+  br_catalog_name: str
+  br_environment: str
+  br_api_token: str
+  output_dir: str = "/export"
+  multi_market: bool = False
+  shopify_market: Optional[str] = None
+  shopify_language: Optional[str] = None
+  auto_index: bool = False
+  delta_mode: bool = False
+  start_date: Optional[str] = None
+  market_cache_enabled: bool = False
+  market_cache_max_age_hours: int = 24
+  # None saves the intermediate files only when debug logging is enabled
+  save_intermediate_files: Optional[bool] = None
+  products_cache_max_age_minutes: int = 0
+  work_root: Optional[str] = None
+  webhook_url: Optional[str] = None
+  webhook_port: int = 8080
+  webhook_secret: Optional[str] = None
+  bulk_shards: int = 1
+  # None uses one worker per CPU available to the job, see utils.available_cpus
+  workers: Optional[int] = None
+
+  def __post_init__(self):
+    if self.br_environment.lower() not in VALID_ENVIRONMENTS:
+      raise ValueError(f"Bloomreach environment must be one of: {', '.join(VALID_ENVIRONMENTS)}")
+    if not ACCOUNT_ID_PATTERN.fullmatch(self.br_account_id):
+      raise ValueError("Bloomreach account ID must be exactly 4 digits")
+    if self.multi_market and not self.shopify_market:
+      raise ValueError("--shopify-market is required when --multi-market is enabled")
+    if self.multi_market and not self.shopify_language:
+      raise ValueError("--shopify-language is required when --multi-market is enabled")
+
+  @classmethod
+  def from_args(cls, args):
+    """
+    Build the settings from parsed command line arguments, letting environment variables override them.
+
+    Args:
+        args: Arguments parsed by a parser from build_parser()
+
+    Returns:
+        Config: The validated settings
+
+    Raises:
+        ValueError: If a setting is invalid
+    """
+    return cls(
+      shopify_url=args.shopify_url,
+      shopify_pat=args.shopify_pat,
+      br_account_id=args.br_account_id,
+      br_catalog_name=args.br_catalog_name,
+      br_environment=args.br_environment,
+      br_api_token=args.br_api_token,
+      output_dir=args.output_dir,
+      multi_market=args.multi_market,
+      shopify_market=args.shopify_market,
+      shopify_language=args.shopify_language,
+      auto_index=env_flag("AUTO_INDEX") or args.auto_index,
+      delta_mode=env_flag("DELTA_MODE") or args.delta_mode,
+      start_date=ENV.get("START_DATE") or args.start_date,
+      market_cache_enabled=env_flag("MARKET_CACHE_ENABLED") or args.market_cache_enabled,
+      market_cache_max_age_hours=int(ENV.get("MARKET_CACHE_MAX_AGE_HOURS") or "24") or args.market_cache_max_age_hours,
+      # Intermediate files are only needed for debugging, so unless set they follow the log level
+      save_intermediate_files=env_flag("BR_SAVE_INTERMEDIATE_FILES") if ENV.get("BR_SAVE_INTERMEDIATE_FILES") else None,
+      products_cache_max_age_minutes=int(ENV.get("PRODUCTS_CACHE_MAX_AGE_MINUTES") or "0") or args.products_cache_max_age_minutes,
+      work_root=ENV.get("BR_WORK_DIR"),
+      webhook_url=ENV.get("BR_WEBHOOK_URL"),
+      webhook_port=int(ENV.get("BR_WEBHOOK_PORT") or "8080"),
+      webhook_secret=ENV.get("BR_WEBHOOK_SECRET"),
+      bulk_shards=int(ENV.get("BR_BULK_SHARDS") or "0") or args.bulk_shards,
+      workers=int(ENV.get("BR_WORKERS") or "0") or args.workers
+    )
@@ -1,10 +1,20 @@
 import logging
-import polling
 import requests
 from os import getenv
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from utils import wait_until
 
 logger = logging.getLogger(__name__)
 
+# Upload and status requests share pooled keep-alive connections. Only GETs are retried after a
+# request was sent, since a feed upload's file body can't be replayed; connect errors are retried for all.
+session = requests.Session()
+session.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=8,
+                                      max_retries=Retry(total=3, backoff_factor=0.5,
+                                                        allowed_methods=frozenset({"GET"}))))
+
 
 def hostname_from_environment(environment="staging"):
   hostnames = {
@@ -21,7 +31,8 @@ def patch_catalog_delta(
         account_id="",
         environment_name="",
         catalog_name="",
-        token=""):
+        token="",
+        session=session):
 
   dc_endpoint = "dataconnect/api/v1"
 
@@ -38,16 +49,15 @@ def patch_catalog_delta(
     "Authorization": "Bearer " + token
   }
 
-  feed_job_id = ""
   with open(patch_fp, 'rb') as payload:
-    response = requests.patch(url, data=payload, headers=headers)  # Use PATCH instead of PUT
+    response = session.patch(url, data=payload, headers=headers)  # Use PATCH instead of PUT
     response.raise_for_status()
 
     logger.info("Feed API: HTTP PATCH: %s", response.url)
     logger.info("Feed Job response: %s", response.json())
     job_id = response.json()["jobId"]
 
-  polling.poll(lambda: br_check_status(job_id=job_id, environment_name=environment_name, token=token), step=10, timeout=7200)
+  wait_until(lambda: br_check_status(job_id=job_id, environment_name=environment_name, token=token, session=session), timeout=7200, max_step=10)
 
 
 def patch_catalog(
@@ -55,7 +65,8 @@ def patch_catalog(
     account_id="",
     environment_name="",
     catalog_name="",
-    token=""):
+    token="",
+    session=session):
 
   dc_endpoint = "dataconnect/api/v1"
 
@@ -72,19 +83,18 @@ def patch_catalog(
     "Authorization": "Bearer " + token
   }
 
-  feed_job_id = ""
   with open(patch_fp, 'rb') as payload:
-    response = requests.put(url, data=payload, headers=headers)
+    response = session.put(url, data=payload, headers=headers)
     response.raise_for_status()
 
     logger.info("Feed API: HTTP PUT: %s", response.url)
     logger.info("Feed Job response: %s", response.json())
     job_id = response.json()["jobId"]
 
-  polling.poll(lambda: br_check_status(job_id=job_id, environment_name=environment_name, token=token), step=10, timeout=7200)
+  wait_until(lambda: br_check_status(job_id=job_id, environment_name=environment_name, token=token, session=session), timeout=7200, max_step=10)
   
 
-def br_check_status(job_id="", environment_name="", token=""):
+def br_check_status(job_id="", environment_name="", token="", session=session):
   dc_endpoint = "dataconnect/api/v1"
   hostname = hostname_from_environment(environment_name)
   url = f"https://{hostname}/{dc_endpoint}/jobs/{job_id}"
@@ -92,7 +102,7 @@ def br_check_status(job_id="", environment_name="", token=""):
     "Authorization": "Bearer " + token
   }
   logger.info("Checking status for job: %s", url)
-  response = requests.get(url, headers=headers)
+  response = session.get(url, headers=headers)
   response.raise_for_status()
   state = response.json()["status"]
   logger.info("Current job status: %s", state)
@@ -1,19 +1,122 @@
-import gzip
+import functools
+import hashlib
 import json
 import logging
-import polling
 import requests
 import shopify
 import shutil
+import subprocess
+import time
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from isal import igzip
 from os import getenv
 from pathlib import Path
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 import os
 
+from utils import wait_until
+from webhook import BulkOperationListener
+
 logger = logging.getLogger(__name__)
 
+# Size of the blocks copied from the download stream into the local file, 1 MiB unless overridden
+DOWNLOAD_CHUNK_SIZE = int(getenv("BR_DOWNLOAD_CHUNK_SIZE", str(1 << 20)))
+
+# A complete gzip stream of no data, written as is when a bulk operation returns no objects
+EMPTY_GZIP = b'\x1f\x8b\x08\x00\x00\x00\x00\x00\x00\xff\x03\x00\x00\x00\x00\x00\x00\x00\x00\x00'
+
+# With a webhook listener, the bulk operation status is still queried this often in case a delivery is lost
+WEBHOOK_FALLBACK_STEP = 120
+
+# Shopify runs at most this many bulk query operations at a time per shop (API 2026-01 and later)
+MAX_CONCURRENT_BULK_OPS = 5
+
+# Listener for bulk operation finish webhooks, started by start_webhook_listener when webhooks are configured
+bulk_op_listener = None
+
+# Id of the bulk operation finish webhook subscription created by this run, removed again by stop_webhook_listener
+bulk_op_webhook_id = None
+
+# One HTTP session for every bulk file download in the run, so connections are reused;
+# dropped connections, rate limiting and transient server errors are retried before a download fails.
+# After the last retry the error response is returned, so raise_for_status reports it.
+download_session = requests.Session()
+download_session.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=8,
+                                               max_retries=Retry(total=3, backoff_factor=0.5,
+                                                                 status_forcelist=(429, 500, 502, 503, 504),
+                                                                 allowed_methods=frozenset({"GET"}),
+                                                                 raise_on_status=False)))
 
-def export_jsonl(context, language=None, start_date=None):
+@functools.lru_cache(maxsize=None)
+def load_query(query_file, language=None, start_date=None):
+  """
+  Reads a GraphQL query file and fills in its template variables.
+  Results are cached, so polling the same query again does not touch the file system.
+
+  Args:
+      query_file: Name of the file in the graphql_queries directory
+      language: Optional language code replacing {language}
+      start_date: Optional start date replacing {start_date}
+
+  Returns:
+      str: The templated query
+  """
+  query = Path(f'./graphql_queries/{query_file}').read_text()
+
+  # Replace template variables
+  if language:
+    query = query.replace("{language}", language)
+  if start_date:
+    query = query.replace("{start_date}", start_date)
+  return query
+
+def is_bulk_op_clear():
+  """
+  Checks whether the shop's current bulk operation, if any, has finished,
+  so a new one can be submitted without being rejected as already in progress.
+
+  Returns:
+      bool: True if no bulk operation is running, False otherwise
+  """
+  query = load_query('current_job.graphql')
+  result_json = json.loads(shopify.GraphQL().execute(query=query, operation_name="CurrentJob"))
+
+  if 'errors' in result_json:
+    raise RuntimeError("Errors encountered while running CurrentJob query")
+
+  node = result_json["data"]["currentBulkOperation"]
+  if node is None or node["status"] in ("COMPLETED", "CANCELED", "EXPIRED", "FAILED"):
+    return True
+
+  logger.info("Waiting for bulk operation %s to finish, current state: %s", node["id"], node["status"])
+  return False
+
+def get_export_query_file(language=None, start_date=None):
+  """
+  Chooses the product export query file for the given options - handles all combinations.
+  """
+  if start_date and language:
+    return 'export_data_job_delta_translations.graphql'
+  if start_date:
+    return 'export_data_job_delta.graphql'
+  if language:
+    return 'export_data_job_translations.graphql'
+  return 'export_data_job.graphql'
+
+def add_product_filter(query, product_filter):
+  """
+  Narrows the products connection of an export query with a search filter,
+  combined with the delta filter when the query already has one.
+  """
+  if not product_filter:
+    return query
+  if 'products (query: "' in query:
+    return query.replace('products (query: "', f'products (query: "{product_filter} AND ', 1)
+  return query.replace('products {', f'products (query: "{product_filter}") {{', 1)
+
+def export_jsonl(context, language=None, start_date=None, product_filter=None):
   """
   Attempts to run a Bulk Operation query to initiate a job
   that will extract a JSONL file with all of a Shop's product information.
@@ -22,6 +125,7 @@ def export_jsonl(context, language=None, start_date=None):
       context: Dictionary to store job information
       language: Optional language code for translations
       start_date: Optional start date for delta queries (ISO format)
+      product_filter: Optional search filter limiting the exported products, e.g. to a created_at window
 
   Returns:
       bool: True if job was submitted successfully, False otherwise
@@ -29,32 +133,28 @@ def export_jsonl(context, language=None, start_date=None):
   if language:
     logger.info("ExportDataJob using language: %s", language)
 
-  # Choose which query file to use based on parameters - handle all combinations
-  if start_date and language:
-    query_file = 'export_data_job_delta_translations.graphql'
-    logger.info("ExportDataJob using delta mode with translations, start_date: %s, language: %s", start_date, language)
-  elif start_date:
-      query_file = 'export_data_job_delta.graphql'
-      logger.info("ExportDataJob using delta mode with start_date: %s", start_date)
-  elif language:
-      query_file = 'export_data_job_translations.graphql'
-      logger.info("ExportDataJob using translations with language: %s", language)
+  if start_date:
+    logger.info("ExportDataJob using delta mode with start_date: %s", start_date)
   else:
-      query_file = 'export_data_job.graphql'
-      logger.info("ExportDataJob using standard mode")
+    logger.info("ExportDataJob using standard mode")
 
-  query = Path(f'./graphql_queries/{query_file}').read_text()
+  query_file = get_export_query_file(language=language, start_date=start_date)
+  query = add_product_filter(load_query(query_file, language=language, start_date=start_date), product_filter)
+  if product_filter:
+    logger.info("ExportDataJob using product filter: %s", product_filter)
 
-  # Replace template variables
-  if language:
-    query = query.replace("{language}", language)
-  if start_date:
-    query = query.replace("{start_date}", start_date)
-
-  logger.info("ExportDataJob graph ql query:\n %s", query)
+  # The query text runs to several KB and is resent on every retry, so only log it when debugging
+  if logger.isEnabledFor(logging.DEBUG):
+    logger.debug("ExportDataJob graph ql query:\n %s", query)
   logger.info("ExportDataJob attempt using query file: %s", query_file)
 
   result = shopify.GraphQL().execute(query=query, operation_name="ExportDataJob")
+
+  # Another bulk operation running is the common retry case, so spot it before parsing the response
+  if "already in progress" in result:
+    logger.info("GraphQL Bulk Operation not submitted, trying again after delay. Another operation already in progress: %s", result)
+    return False
+
   result_json = json.loads(result)
 
   if 'errors' in result_json:
@@ -68,9 +168,6 @@ def export_jsonl(context, language=None, start_date=None):
     logger.info("GraphQL Bulk Operation submitted successfully. Job id: %s", job_id)
     context["job_id"] = job_id
     return True
-  elif "already in progress" in result:
-    logger.info("GraphQL Bulk Operation not submitted, trying again after delay. Another operation already in progress: %s", result_json)
-    return False
   else:
     logger.error(result_json)
     raise RuntimeError("Unable to start ExportDataJob")
@@ -81,18 +178,24 @@ def export_market_jsonl(context):
   Similar to export_jsonl but specifically for market data.
   Uses a different GraphQL query to fetch market-specific product mappings.
   """
-  query = Path('./graphql_queries/market_products_job.graphql').read_text()
+  query = load_query('market_products_job.graphql')
   logger.info("MarketProductsJob attempt")
   try:
     result = shopify.GraphQL().execute(query=query,
                                        operation_name="MarketProductsJob")
+
+    # Another bulk operation running is the common retry case, so spot it before parsing the response
+    if "already in progress" in result:
+      logger.info("GraphQL Market Bulk Operation not submitted, trying again after delay. Another operation already in progress: %s", result)
+      return False
+
     result_json = json.loads(result)
 
     # Log the full error response for debugging
     if 'errors' in result_json:
       logger.error("GraphQL Errors:")
       for error in result_json['errors']:
-        logger.error(f"Error: {json.dumps(error, indent=2)}")
+        logger.error("Error: %s", error)
       raise RuntimeError(f"Errors encountered while running MarketProductsJob query: {result_json['errors']}")
 
     bulkOperation = result_json["data"]["bulkOperationRunQuery"]["bulkOperation"]
@@ -102,18 +205,56 @@ def export_market_jsonl(context):
       logger.info("GraphQL Market Bulk Operation submitted successfully. Job id: %s", job_id)
       context["market_job_id"] = job_id
       return True
-    elif "already in progress" in result:
-      logger.info("GraphQL Market Bulk Operation not submitted, trying again after delay. Another operation already in progress: %s", result_json)
-      return False
     else:
-      logger.error(f"Unexpected response: {json.dumps(result_json, indent=2)}")
+      logger.error("Unexpected response: %s", result_json)
       raise RuntimeError("Unable to start MarketProductsJob")
 
   except Exception as e:
-    logger.error(f"Exception in export_market_jsonl: {str(e)}")
-    logger.error(f"Query being executed: {query}")
+    logger.error("Exception in export_market_jsonl: %s", e)
+    logger.debug("Query being executed: %s", query)
     raise
 
+def get_oldest_product_created_at():
+  """
+  Returns:
+      datetime: Creation time of the shop's oldest product, or None if it has no products
+  """
+  query = load_query('oldest_product.graphql')
+  result_json = json.loads(shopify.GraphQL().execute(query=query, operation_name="OldestProduct"))
+
+  if 'errors' in result_json:
+    raise RuntimeError("Errors encountered while running OldestProduct query")
+
+  edges = result_json["data"]["products"]["edges"]
+  if not edges:
+    return None
+  return datetime.fromisoformat(edges[0]["node"]["createdAt"].replace('Z', '+00:00'))
+
+def get_created_at_filters(shards):
+  """
+  Splits the shop's products into up to `shards` created_at windows of equal length,
+  from its oldest product until now. The first and last windows are open ended, so
+  together they cover every product exactly once.
+
+  Returns:
+      list: Product search filters, one per window
+  """
+  oldest = get_oldest_product_created_at()
+  if shards <= 1 or oldest is None:
+    return [None]
+
+  step = (datetime.now(timezone.utc) - oldest) / shards
+  cuts = [(oldest + step * i).strftime('%Y-%m-%dT%H:%M:%SZ') for i in range(1, shards)]
+  filters = []
+  for lower, upper in zip([None] + cuts, cuts + [None]):
+    bounds = []
+    if lower:
+      bounds.append(f"created_at:>='{lower}'")
+    if upper:
+      bounds.append(f"created_at:<'{upper}'")
+    filters.append(" AND ".join(bounds))
+  return filters
+
 def get_jsonl_url(job_id, context):
   """
   Given a Bulk Operation job id, polls for status and objectCount.
@@ -128,7 +269,7 @@ def get_jsonl_url(job_id, context):
 
   https://shopify.dev/api/usage/bulk-operations/queries#option-b-poll-a-running-bulk-operation
   """
-  query = Path('./graphql_queries/get_job.graphql').read_text()
+  query = load_query('get_job.graphql')
   logger.info("GetJob query for job_id: %s" % job_id)
   result = shopify.GraphQL().execute(query=query,
                                      operation_name="GetJob",
@@ -169,16 +310,176 @@ def get_jsonl_url(job_id, context):
   return False
 
 
-def download_file(url, local_filename):
-  with requests.get(url, stream=True) as r:
+def register_bulk_op_webhook(callback_url):
+  """
+  Subscribes callback_url to the shop's bulk operation finish webhook.
+  An existing subscription for the same address is left in place.
+
+  Returns:
+      str: Id of the new subscription, or None if an existing one is used
+  """
+  query = load_query('webhook_subscription_create.graphql')
+  result_json = json.loads(shopify.GraphQL().execute(query=query,
+                                                     operation_name="WebhookSubscriptionCreate",
+                                                     variables={"callbackUrl": callback_url}))
+
+  if 'errors' in result_json:
+    raise RuntimeError("Errors encountered while running WebhookSubscriptionCreate query")
+
+  user_errors = result_json["data"]["webhookSubscriptionCreate"]["userErrors"]
+  if user_errors and not all("already been taken" in error["message"] for error in user_errors):
+    raise RuntimeError(f"Unable to subscribe to bulk operation webhooks: {user_errors}")
+  logger.info("Subscribed to bulk operation finish webhooks at: %s", callback_url)
+
+  subscription = result_json["data"]["webhookSubscriptionCreate"]["webhookSubscription"]
+  return subscription["id"] if subscription else None
+
+def delete_bulk_op_webhook(subscription_id):
+  """
+  Removes a bulk operation finish webhook subscription, so Shopify stops delivering to a listener that is gone.
+  """
+  query = load_query('webhook_subscription_delete.graphql')
+  result_json = json.loads(shopify.GraphQL().execute(query=query,
+                                                     operation_name="WebhookSubscriptionDelete",
+                                                     variables={"id": subscription_id}))
+
+  if 'errors' in result_json:
+    raise RuntimeError("Errors encountered while running WebhookSubscriptionDelete query")
+
+  user_errors = result_json["data"]["webhookSubscriptionDelete"]["userErrors"]
+  if user_errors:
+    raise RuntimeError(f"Unable to unsubscribe from bulk operation webhooks: {user_errors}")
+  logger.info("Unsubscribed from bulk operation finish webhooks: %s", subscription_id)
+
+def start_webhook_listener(callback_url, port, secret=None):
+  """
+  Starts listening for bulk operation finish webhooks and subscribes callback_url to them.
+  callback_url must be a public address that reaches port on this container. If anything
+  fails, the job carries on polling for bulk operation status instead.
+  """
+  global bulk_op_listener, bulk_op_webhook_id
+  if bulk_op_listener is not None:
+    return
+  try:
+    listener = BulkOperationListener(port, secret)
+    listener.start()
+  except OSError as e:
+    logger.warning("Unable to listen for webhooks on port %s, polling instead: %s", port, e)
+    return
+  try:
+    bulk_op_webhook_id = register_bulk_op_webhook(callback_url)
+  except Exception as e:
+    logger.warning("Unable to subscribe to bulk operation webhooks, polling instead: %s", e)
+    listener.stop()
+    return
+  bulk_op_listener = listener
+
+def stop_webhook_listener():
+  """
+  Stops the webhook listener, first removing the webhook subscription if this run created it.
+  The job's container doesn't outlive the run, so deliveries to it would only fail and be retried.
+  Must be called while the Shopify session is still active.
+  """
+  global bulk_op_listener, bulk_op_webhook_id
+  if bulk_op_webhook_id is not None:
+    try:
+      delete_bulk_op_webhook(bulk_op_webhook_id)
+    except Exception as e:
+      logger.warning("Unable to remove bulk operation webhook subscription %s: %s", bulk_op_webhook_id, e)
+    bulk_op_webhook_id = None
+  if bulk_op_listener is not None:
+    bulk_op_listener.stop()
+    bulk_op_listener = None
+
+def wait_for_bulk_op(job_id, context, timeout=7200):
+  """
+  Waits for a bulk operation to finish, filling context like get_jsonl_url.
+  Without a webhook listener, the status is polled with backoff. With one, the status is
+  checked each time the finish webhook arrives, or every WEBHOOK_FALLBACK_STEP seconds.
+  """
+  if bulk_op_listener is None:
+    wait_until(lambda: get_jsonl_url(job_id, context), timeout=timeout)
+    return
+
+  deadline = time.monotonic() + timeout
+  while not get_jsonl_url(job_id, context):
+    remaining = deadline - time.monotonic()
+    if remaining <= 0:
+      raise TimeoutError(f"Bulk operation {job_id} did not finish within {timeout} seconds")
+    bulk_op_listener.wait(job_id, min(WEBHOOK_FALLBACK_STEP, remaining))
+
+def session_executor(session, max_workers):
+  """
+  Thread pool whose threads run their Shopify queries in session. ShopifyAPI keeps the active
+  session, including its access token header, per thread, so new threads don't inherit it.
+  """
+  return ThreadPoolExecutor(max_workers=max_workers,
+                            initializer=shopify.ShopifyResource.activate_session,
+                            initargs=(session,))
+
+def copy_stream(src, dst, digest=None):
+  """
+  Copy a file-like object to another in DOWNLOAD_CHUNK_SIZE blocks, feeding each block to digest if given.
+  """
+  if digest is None:
+    shutil.copyfileobj(src, dst, DOWNLOAD_CHUNK_SIZE)
+    return
+  for chunk in iter(lambda: src.read(DOWNLOAD_CHUNK_SIZE), b''):
+    digest.update(chunk)
+    dst.write(chunk)
+
+def download_file(url, local_filename, digest=None):
+  """
+  Stream a bulk operation JSONL file to a local gzipped file.
+
+  When Shopify's CDN serves the file with a gzip Content-Encoding, the body already is the gzipped
+  JSONL, so its raw bytes are written straight to disk without being decoded and recompressed.
+  Otherwise the plain JSONL is compressed with ISA-L at level 1: the file is only an intermediate
+  that the next stage decompresses again, so speed matters far more than ratio. The gzip trailer
+  CRC32 is then computed by ISA-L as well, and in the pass-through case it isn't computed at all.
+
+  If a hashlib digest is given, it is updated with the response body as it is downloaded.
+  """
+  with download_session.get(url, stream=True) as r:
     r.raise_for_status()
-    with gzip.open(local_filename, 'wb') as f:
-      for chunk in r.iter_content(chunk_size=8192):  # Stream in small chunks
-        f.write(chunk)
+    if r.headers.get("Content-Encoding", "").lower() == "gzip":
+      r.raw.decode_content = False
+      with open(local_filename, 'wb') as f:
+        copy_stream(r.raw, f, digest)
+    else:
+      # Read the urllib3 stream directly in large blocks, still decoding any other Content-Encoding
+      r.raw.decode_content = True
+      with igzip.open(local_filename, 'wb', compresslevel=1) as f:
+        copy_stream(r.raw, f, digest)
   return local_filename
 
-def get_market_cache_path(output_dir):
-  return f"{output_dir}/market_data_cache.json"
+def link_or_copy(src, dst):
+  """
+  Give src a second name at dst without copying its data where the filesystem allows it:
+  a hardlink, then a copy-on-write reflink, then a plain copy. dst is replaced atomically.
+  """
+  tmp_path = f"{dst}.tmp"
+  if os.path.lexists(tmp_path):
+    os.remove(tmp_path)
+  try:
+    os.link(src, tmp_path)
+  except OSError:
+    try:
+      subprocess.run(['cp', '--reflink=auto', '--preserve=timestamps', src, tmp_path], check=True)
+    except (OSError, subprocess.CalledProcessError):
+      shutil.copy2(src, tmp_path)
+  os.replace(tmp_path, dst)
+
+def get_market_cache_key(shop_url, shopify_market=None, shopify_language=None, api_version=None):
+  """
+  Hash of everything that identifies a market data export, naming its cache file so that
+  different shops, markets, languages or API versions never share cached market data.
+  """
+  key = json.dumps([shop_url.lower(), shopify_market, shopify_language, api_version])
+  return hashlib.sha256(key.encode()).hexdigest()
+
+def get_market_cache_path(output_dir, cache_key):
+  return f"{output_dir}/.market_cache/{cache_key}.jsonl.gz"
 
 def is_market_cache_valid(cache_path, max_age_hours=24):
   """Check if market data cache is still valid."""
@@ -188,29 +489,268 @@ def is_market_cache_valid(cache_path, max_age_hours=24):
   cache_age = datetime.now() - datetime.fromtimestamp(os.path.getmtime(cache_path))
   return cache_age < timedelta(hours=max_age_hours)
 
-def save_market_cache_info(cache_path, market_file_path):
+def get_market_cache_info_path(cache_path):
+  return cache_path.replace('.jsonl.gz', '.meta.json')
+
+def save_market_cache_info(cache_path, market_file_path, content_hash=None):
   """Save metadata about the cached market data."""
   cache_info = {
     "cached_at": datetime.now().isoformat(),
-    "market_file": os.path.basename(market_file_path)
+    "market_file": os.path.basename(market_file_path),
+    "content_hash": content_hash
   }
-  info_path = cache_path.replace('.json', '_info.json')
-  with open(info_path, 'w') as f:
+  with open(get_market_cache_info_path(cache_path), 'w') as f:
     json.dump(cache_info, f)
 
-def get_cached_market_file(output_dir, max_age_hours=24):
+def load_market_cache_info(cache_path):
+  """Load metadata about the cached market data, or an empty dict if there is none."""
+  try:
+    with open(get_market_cache_info_path(cache_path)) as f:
+      return json.load(f)
+  except (OSError, ValueError):
+    return {}
+
+def get_cached_market_file(cache_path, max_age_hours=24):
   """Get the path to cached market data if it exists and is valid."""
-  cache_path = get_market_cache_path(output_dir)
   if is_market_cache_valid(cache_path, max_age_hours):
     return cache_path
   return None
 
+def get_products_cache_key(shop_url, language=None, start_date=None, api_version=None):
+  """
+  Describes a product export by everything that determines its result: the shop, the API version
+  and the exact query text. Files exported with a different API version may follow another schema.
+  """
+  query = load_query(get_export_query_file(language=language, start_date=start_date),
+                     language=language, start_date=start_date)
+  return {
+    "shop": shop_url,
+    "start_date": start_date,
+    "language": language,
+    "api_version": api_version,
+    "query_sha256": hashlib.sha256(query.encode()).hexdigest()
+  }
+
+def get_products_cache_info_path(products_jsonl_fp):
+  return products_jsonl_fp.replace('.jsonl.gz', '.meta.json')
+
+def save_products_cache_info(products_jsonl_fp, cache_key, job_id, object_count):
+  """Save a sidecar file describing the export a products file was downloaded from."""
+  cache_info = dict(cache_key,
+                    job_id=job_id,
+                    object_count=object_count,
+                    downloaded_at=datetime.now().isoformat())
+  with open(get_products_cache_info_path(products_jsonl_fp), 'w') as f:
+    json.dump(cache_info, f)
+
+def get_cached_products_file(output_dir, cache_key, max_age_minutes):
+  """
+  Find the most recent products file downloaded for the same export within max_age_minutes.
+
+  Returns:
+      tuple: (products_file_path, cache_info), or (None, None) if there is no usable file
+  """
+  oldest = datetime.now() - timedelta(minutes=max_age_minutes)
+  best_fp, best_info = None, None
+  for info_path in Path(output_dir).glob('*_shopify_bulk_op.meta.json'):
+    try:
+      with open(info_path) as f:
+        cache_info = json.load(f)
+      downloaded_at = datetime.fromisoformat(cache_info["downloaded_at"])
+    except (OSError, ValueError, KeyError):
+      continue
+    if downloaded_at < oldest or any(cache_info.get(k) != v for k, v in cache_key.items()):
+      continue
+    products_fp = str(info_path).replace('.meta.json', '.jsonl.gz')
+    if os.path.exists(products_fp) and (best_info is None or downloaded_at > best_info[0]):
+      best_fp, best_info = products_fp, (downloaded_at, cache_info)
+  return (best_fp, best_info[1]) if best_fp else (None, None)
+
+def export_products_jsonl(products_jsonl_fp, language=None, start_date=None, product_filter=None,
+                          wait_for_clear=True):
+  """
+  Runs one product export bulk operation and downloads its output.
+
+  Args:
+      products_jsonl_fp: File path to save the products file to
+      language: Optional language code for translations
+      start_date: Optional start date for delta queries (ISO format string)
+      product_filter: Optional search filter limiting the exported products
+      wait_for_clear: Only submit the export once no other bulk operation is running. Sibling
+          shards skip this, as they are meant to run side by side.
+
+  Returns:
+      tuple: (job_id, object_count)
+  """
+  # Submit job for main product export, only sending the mutation once the cheap status
+  # query shows no other bulk operation is running
+  context = {}
+  wait_until(
+    lambda: (not wait_for_clear or is_bulk_op_clear())
+            and export_jsonl(context, language=language, start_date=start_date, product_filter=product_filter),
+    timeout=7200
+  )
+  job_id = context["job_id"]
+
+  # Get main product jsonl url
+  context = {}
+  wait_for_bulk_op(job_id, context)
+  jsonl_url = context["url"]
+  logger.info("products jsonl url: %s", jsonl_url)
+  object_count = context.get("object_count", 0)
+
+  if jsonl_url is None or object_count == 0:
+    logger.info("No products found for query, creating empty file: %s", products_jsonl_fp)
+    # Create an empty gzipped JSONL file
+    Path(products_jsonl_fp).write_bytes(EMPTY_GZIP)
+  else:
+    logger.info("Saving products jsonl file to: %s", products_jsonl_fp)
+    download_file(jsonl_url, products_jsonl_fp)
+
+  return job_id, object_count
+
+def export_products_jsonl_sharded(products_jsonl_fp, session, language=None, start_date=None,
+                                  shards=MAX_CONCURRENT_BULK_OPS, wait_for_clear=True):
+  """
+  Runs the product export as several bulk operations side by side, one per created_at window,
+  and joins their downloads into a single products file. Each product is exported by exactly
+  one shard together with its children, and gzip files can be concatenated as they are, so the
+  result reads like the output of a single export. The shards run their queries in session.
+  wait_for_clear only applies when the export ends up as a single shard.
+
+  Returns:
+      tuple: (job_id of the first shard, total object_count)
+  """
+  product_filters = get_created_at_filters(shards)
+  if len(product_filters) == 1:
+    return export_products_jsonl(products_jsonl_fp, language, start_date, wait_for_clear=wait_for_clear)
+
+  logger.info("Exporting products in %s concurrent shards", len(product_filters))
+  shard_fps = [products_jsonl_fp.replace('.jsonl.gz', f'_shard{i}.jsonl.gz') for i in range(len(product_filters))]
+  with session_executor(session, max_workers=min(len(product_filters), MAX_CONCURRENT_BULK_OPS)) as executor:
+    results = list(executor.map(
+      lambda shard: export_products_jsonl(shard[0], language, start_date, product_filter=shard[1], wait_for_clear=False),
+      zip(shard_fps, product_filters)
+    ))
+
+  with open(products_jsonl_fp, 'wb') as out:
+    for shard_fp in shard_fps:
+      with open(shard_fp, 'rb') as f:
+        shutil.copyfileobj(f, out, DOWNLOAD_CHUNK_SIZE)
+      os.remove(shard_fp)
+
+  return results[0][0], sum(object_count for _, object_count in results)
+
+def download_products_jsonl(products_jsonl_fp, language=None, start_date=None,
+                            cache_key=None, cache_max_age_minutes=0, shards=1, session=None,
+                            wait_for_clear=True):
+  """
+  Runs the product export bulk operation and downloads its output.
+  When cache_max_age_minutes is set, a products file downloaded for the same export within that
+  window is reused instead, and each new download records a sidecar describing its export.
+
+  Args:
+      products_jsonl_fp: File path to save the products file to
+      language: Optional language code for translations
+      start_date: Optional start date for delta queries (ISO format string)
+      cache_key: Export description from get_products_cache_key, required when caching
+      cache_max_age_minutes: Maximum age of a reusable products file in minutes, 0 disables reuse
+      shards: Number of concurrent bulk operations to split the export into
+      session: Shopify session the shards run their queries in, required when shards > 1
+      wait_for_clear: Only submit the export once no other bulk operation is running
+
+  Returns:
+      str: Full GID of the bulk operation job
+  """
+  if cache_max_age_minutes:
+    cached_fp, cache_info = get_cached_products_file(os.path.dirname(products_jsonl_fp) or '.',
+                                                     cache_key, cache_max_age_minutes)
+    if cached_fp:
+      logger.info("Reusing products file from bulk operation %s downloaded at %s: %s",
+                  cache_info["job_id"], cache_info["downloaded_at"], cached_fp)
+      link_or_copy(cached_fp, products_jsonl_fp)
+      return cache_info["job_id"]
+
+  if shards > 1:
+    job_id, object_count = export_products_jsonl_sharded(products_jsonl_fp, session, language, start_date, shards,
+                                                         wait_for_clear=wait_for_clear)
+  else:
+    job_id, object_count = export_products_jsonl(products_jsonl_fp, language, start_date,
+                                                 wait_for_clear=wait_for_clear)
+
+  if cache_max_age_minutes:
+    save_products_cache_info(products_jsonl_fp, cache_key, job_id, object_count)
+
+  return job_id
+
+def download_market_jsonl(cache_path, market_jsonl_fp, market_cache_enabled=True, market_cache_max_age_hours=24,
+                          wait_for_clear=True):
+  """
+  Runs the market data export bulk operation and downloads its output,
+  caching it for future delta feeds when caching is enabled.
+
+  Args:
+      cache_path: Market data cache file for this shop, market, language and API version
+      market_jsonl_fp: File path to save the market data file to
+      market_cache_enabled: Whether to use market data caching
+      market_cache_max_age_hours: Maximum age of cached market data in hours
+      wait_for_clear: Only submit the export once no other bulk operation is running. Skipped when
+          the product export runs alongside it, which would otherwise hold it back until the end.
+
+  Returns:
+      str: File path of the market data file
+  """
+  # Submit job for market data export, only sending the mutation once the cheap status
+  # query shows no other bulk operation is running
+  market_context = {}
+  wait_until(lambda: (not wait_for_clear or is_bulk_op_clear()) and export_market_jsonl(market_context),
+             timeout=7200)
+  market_job_id = market_context["market_job_id"]
+
+  # Get market data jsonl url
+  market_context = {}
+  wait_for_bulk_op(market_job_id, market_context)
+  market_jsonl_url = market_context["url"]
+  market_object_count = market_context.get("object_count", 0)
+
+  if market_jsonl_url is None or market_object_count == 0:
+    logger.info("No market data found, creating empty file: %s", market_jsonl_fp)
+    Path(market_jsonl_fp).write_bytes(EMPTY_GZIP)
+  else:
+    logger.info("Saving market jsonl file to: %s", market_jsonl_fp)
+    digest = hashlib.blake2b() if market_cache_enabled else None
+    download_file(market_jsonl_url, market_jsonl_fp, digest=digest)
+
+    # Cache the market data for future delta feeds (if caching is enabled)
+    if market_cache_enabled:
+      try:
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        content_hash = digest.hexdigest()
+        if os.path.exists(cache_path) and load_market_cache_info(cache_path).get("content_hash") == content_hash:
+          # Same market data as the cached copy, so only its age needs refreshing
+          os.utime(cache_path)
+          logger.info("Market data unchanged since last cached")
+        else:
+          link_or_copy(market_jsonl_fp, cache_path)
+        save_market_cache_info(cache_path, market_jsonl_fp, content_hash)
+        logger.info("Cached market data for future delta feeds: %s (valid for %d hours)",
+                    cache_path, market_cache_max_age_hours)
+      except Exception as e:
+        logger.warning("Failed to cache market data: %s", e)
+
+  return market_jsonl_fp
+
 def get_shopify_jsonl_fp(shop_url, api_version, token, output_dir, run_num="",
                          multiMarket=False, shopify_market=None, shopify_language=None,
-                         start_date=None, market_cache_enabled=True, market_cache_max_age_hours=24):
+                         start_date=None, market_cache_enabled=True, market_cache_max_age_hours=24,
+                         products_cache_max_age_minutes=0, webhook_url=None, webhook_port=8080,
+                         webhook_secret=None, bulk_shards=1):
   """
   Downloads product data from Shopify using bulk operations.
   For delta feeds with multiMarket, uses cached market data if available and caching is enabled.
+  When fresh market data is needed, the product and market bulk operations run concurrently.
+  When products_cache_max_age_minutes is set, a products file downloaded by a recent run for the
+  same shop and query is reused instead of running the product export again.
 
   Args:
       shop_url: Shopify shop URL
@@ -224,6 +764,13 @@ def get_shopify_jsonl_fp(shop_url, api_version, token, output_dir, run_num="",
       start_date: Optional start date for delta queries (ISO format string)
       market_cache_enabled: Whether to use market data caching
       market_cache_max_age_hours: Maximum age of cached market data in hours
+      products_cache_max_age_minutes: Maximum age of a reusable products file in minutes, 0 disables reuse
+      webhook_url: Optional public URL routed to webhook_port, to be notified of finished bulk operations
+          rather than polling for them
+      webhook_port: Local port to receive bulk operation webhooks on
+      webhook_secret: Optional app secret used to verify webhook signatures
+      bulk_shards: Number of concurrent bulk operations to split the product export into,
+          by product creation date; needs API version 2026-01 or later to run them side by side
 
   Returns:
       If multiMarket is False:
@@ -231,105 +778,85 @@ def get_shopify_jsonl_fp(shop_url, api_version, token, output_dir, run_num="",
       If multiMarket is True:
           Tuple of (products_file_path, market_file_path, job_id)
   """
+  # ShopifyAPI keeps the active session per thread, so export threads activate it again themselves
   session = shopify.Session(shop_url, api_version, token)
   shopify.ShopifyResource.activate_session(session)
 
-  # Submit job for main product export
-  context = {}
-  polling.poll(
-    lambda: export_jsonl(context, language=shopify_language if multiMarket else None, start_date=start_date),
-    step=20,
-    timeout=7200
-  )
-  job_id = context["job_id"]
+  try:
+    if webhook_url:
+      start_webhook_listener(webhook_url, webhook_port, webhook_secret)
+
+    # Download main product file with run_num
+    products_jsonl_fp = f"{output_dir}/{run_num}_shopify_bulk_op.jsonl.gz"
+    language = shopify_language if multiMarket else None
+    products_options = {
+      "language": language,
+      "start_date": start_date,
+      "cache_key": get_products_cache_key(shop_url, language, start_date, api_version),
+      "cache_max_age_minutes": products_cache_max_age_minutes,
+      "shards": min(bulk_shards, MAX_CONCURRENT_BULK_OPS),
+      "session": session
+    }
+
+    market_jsonl_fp = None
+    if not multiMarket:
+      job_id = download_products_jsonl(products_jsonl_fp, **products_options)
+    else:
+        # Download market data file with run_num
+        market_jsonl_fp = f"{output_dir}/{run_num}_shopify_market_bulk_op.jsonl.gz"
+        market_cache_path = get_market_cache_path(
+          output_dir, get_market_cache_key(shop_url, shopify_market, shopify_language, api_version))
+
+        # Check if we can use cached market data (for delta feeds and if caching is enabled)
+        cached_market_file = None
+        if start_date and market_cache_enabled:  # This is a delta feed and caching is enabled
+          cached_market_file = get_cached_market_file(market_cache_path, market_cache_max_age_hours)
+
+        if cached_market_file:
+            # Use cached market data
+            # Link cached file to new filename
+            link_or_copy(cached_market_file, market_jsonl_fp)
+            logger.info("Market data cache hit, using cached market data: %s (age: %.1f hours)",
+                       cached_market_file,
+                       (datetime.now() - datetime.fromtimestamp(os.path.getmtime(cached_market_file))).total_seconds() / 3600)
+            job_id = download_products_jsonl(products_jsonl_fp, **products_options)
+        else:
+            # Fetch fresh market data
+            if start_date and market_cache_enabled:
+              logger.info("Market data cache miss or expired, fetching fresh data")
+            elif start_date:
+              logger.info("Market data caching disabled, fetching fresh data")
+            else:
+              logger.info("Full feed mode, fetching fresh market data")
+
+            # Both jobs spend nearly all their time waiting on Shopify, so run them side by side. Neither
+            # waits for the shop's bulk operations to clear, as each would then wait for the other; if the
+            # shop only allows one bulk operation at a time, whichever job is rejected as already in progress
+            # retries until the other has finished. Leave room for the market export among the shop's
+            # concurrent bulk operations.
+            products_options["shards"] = min(bulk_shards, MAX_CONCURRENT_BULK_OPS - 1)
+            with session_executor(session, max_workers=2) as executor:
+              products_future = executor.submit(download_products_jsonl, products_jsonl_fp,
+                                                wait_for_clear=False, **products_options)
+              market_future = executor.submit(download_market_jsonl, market_cache_path, market_jsonl_fp,
+                                              market_cache_enabled, market_cache_max_age_hours,
+                                              wait_for_clear=False)
+              job_id = products_future.result()
+              market_jsonl_fp = market_future.result()
+  finally:
+    # Also on failure, so the listener and its subscription never outlive the run
+    stop_webhook_listener()
+    shopify.ShopifyResource.clear_session()
 
-  # Get main product jsonl url
-  context = {}
-  polling.poll(lambda: get_jsonl_url(job_id, context), step=20, timeout=7200)
-  jsonl_url = context["url"]
-  logger.info("products jsonl url: %s", jsonl_url)
-  object_count = context.get("object_count", 0)
   job_id_short = job_id.split('/')[-1]
-
-  # Download main product file with run_num
-  products_jsonl_fp = f"{output_dir}/{run_num}_shopify_bulk_op.jsonl.gz"
-
-  if jsonl_url is None or object_count == 0:
-    logger.info("No products found for query, creating empty file: %s", products_jsonl_fp)
-    # Create an empty gzipped JSONL file
-    with gzip.open(products_jsonl_fp, 'wb') as f:
-      pass  # Create empty file
-  else:
-    logger.info("Saving products jsonl file to: %s", products_jsonl_fp)
-    download_file(jsonl_url, products_jsonl_fp)
-
-  market_jsonl_fp = None
-  if multiMarket:
-      # Check if we can use cached market data (for delta feeds and if caching is enabled)
-      cached_market_file = None
-      if start_date and market_cache_enabled:  # This is a delta feed and caching is enabled
-        cached_market_file = get_cached_market_file(output_dir, market_cache_max_age_hours)
-
-      if cached_market_file:
-          # Use cached market data
-          market_jsonl_fp = f"{output_dir}/{run_num}_shopify_market_bulk_op.jsonl.gz"
-          # Copy cached file to new filename
-          shutil.copy2(cached_market_file, market_jsonl_fp)
-          logger.info("Using cached market data: %s (age: %.1f hours)",
-                     cached_market_file,
-                     (datetime.now() - datetime.fromtimestamp(os.path.getmtime(cached_market_file))).total_seconds() / 3600)
-      else:
-          # Fetch fresh market data
-          if start_date and market_cache_enabled:
-            logger.info("Market data cache miss or expired, fetching fresh data")
-          elif start_date:
-            logger.info("Market data caching disabled, fetching fresh data")
-          else:
-            logger.info("Full feed mode, fetching fresh market data")
-
-          # Submit job for market data export
-          market_context = {}
-          polling.poll(lambda: export_market_jsonl(market_context), step=20, timeout=7200)
-          market_job_id = market_context["market_job_id"]
-
-          # Get market data jsonl url
-          market_context = {}
-          polling.poll(lambda: get_jsonl_url(market_job_id, market_context), step=20, timeout=7200)
-          market_jsonl_url = market_context["url"]
-          market_object_count = market_context.get("object_count", 0)
-
-          # Download market data file with run_num
-          market_jsonl_fp = f"{output_dir}/{run_num}_shopify_market_bulk_op.jsonl.gz"
-
-          if market_jsonl_url is None or market_object_count == 0:
-            logger.info("No market data found, creating empty file: %s", market_jsonl_fp)
-            with gzip.open(market_jsonl_fp, 'wb') as f:
-              pass  # Create empty file
-          else:
-            logger.info("Saving market jsonl file to: %s", market_jsonl_fp)
-            download_file(market_jsonl_url, market_jsonl_fp)
-
-            # Cache the market data for future delta feeds (if caching is enabled)
-            if market_cache_enabled:
-              try:
-                cache_path = get_market_cache_path(output_dir)
-                shutil.copy2(market_jsonl_fp, cache_path)
-                save_market_cache_info(cache_path, market_jsonl_fp)
-                logger.info("Cached market data for future delta feeds: %s (valid for %d hours)",
-                            cache_path, market_cache_max_age_hours)
-              except Exception as e:
-                logger.warning("Failed to cache market data: %s", e)
-
-  shopify.ShopifyResource.clear_session()
-
   if multiMarket:
     return products_jsonl_fp, market_jsonl_fp, job_id_short
   return products_jsonl_fp, job_id_short
 
 
 if __name__ == '__main__':
-  import argparse
   from sys import stdout
+  from cli import build_parser
 
   # Define logger
   loglevel = getenv('LOGLEVEL', 'INFO').upper()
@@ -339,50 +866,7 @@ if __name__ == '__main__':
     format="%(name)-12s %(asctime)s %(levelname)-8s %(filename)s:%(funcName)s %(message)s"
   )
 
-  parser = argparse.ArgumentParser(
-    description="Extracts a full set of products and their categories from the shopify store and runs a full feed into a Bloomreach Discovery catalog.\n \n"
-                "Uses Shopify's GraphQL Bulk Operation API.\n \n"
-                "During processing, it will save the Shopify bulk operation output jsonl file locally named with the BulkOperation ID value.\n \n"
-                "From there, the file will run through different transforms to create a Bloomreach patch that is then run in full feed mode via the BR Feed API.\n \n"
-                "Each transform step will save its intermediate output locally as well for debugging purposes prefixed with a step number.\n \n"
-                "For example:\n"
-                "23453245234_0.jsonl\n"
-                "23453245234_1_shopify_products.jsonl\n"
-                "23453245234_2_generic_products.jsonl\n"
-                "23453245234_3_br_products.jsonl\n"
-                "23453245234_4_br_patch.jsonl"
-  )
-
-  parser.add_argument(
-    "--shopify-url",
-    help="Hostname of the shopify Shop, e.g. xyz.myshopify.com.",
-    type=str,
-    default=getenv("BR_SHOPIFY_URL"),
-    required=not getenv("BR_SHOPIFY_URL")
-  )
-
-  parser.add_argument(
-    "--shopify-pat",
-    help="Shopify PAT token, e.g shpat_casdcaewras82342dczasdf3",
-    type=str,
-    default=getenv("BR_SHOPIFY_PAT"),
-    required=not getenv("BR_SHOPIFY_PAT")
-  )
-
-  parser.add_argument(
-    "--output-dir",
-    help="Directory path to store the output files to",
-    type=str,
-    default=getenv("BR_OUTPUT_DIR"),
-    required=not getenv("BR_OUTPUT_DIR")
-  )
-
-  parser.add_argument(
-    "--multi-market",
-    help="Enable multi-market product data export",
-    action="store_true",
-    default=False
-  )
+  parser = build_parser(include_feed_options=False)
 
   args = parser.parse_args()
   shopify_url = args.shopify_url
@@ -390,5 +874,5 @@ if __name__ == '__main__':
   output_dir = args.output_dir
   multi_market = args.multi_market
 
-  result = get_shopify_jsonl_fp(shopify_url, '2025-04', shopify_pat, output_dir,
+  result = get_shopify_jsonl_fp(shopify_url, '2026-01', shopify_pat, output_dir,
                                 multiMarket=multi_market)
\ No newline at end of file
@@ -1,11 +1,24 @@
 # job/index.py
 import logging
-import polling
 import requests
 from os import getenv
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from utils import wait_until
 
 logger = logging.getLogger(__name__)
 
+# Index status is polled for as long as the index job runs, so keep the connection alive between polls.
+# Status polls are also retried on rate limiting and transient server errors; the POST triggering
+# an index job is not, since replaying it could start a second job.
+session = requests.Session()
+session.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=8,
+                                      max_retries=Retry(total=3, backoff_factor=0.5,
+                                                        status_forcelist=(429, 500, 502, 503, 504),
+                                                        allowed_methods=frozenset({"GET"}),
+                                                        raise_on_status=False)))
+
 
 def hostname_from_environment(environment="staging"):
     hostnames = {
@@ -36,7 +49,7 @@ def trigger_index(account_id="", environment_name="", catalog_name="", token="")
     }
 
     logger.info("Triggering index job: %s", url)
-    response = requests.post(url, headers=headers)
+    response = session.post(url, headers=headers)
     response.raise_for_status()
 
     job_id = response.json()["jobId"]
@@ -62,7 +75,7 @@ def check_index_status(job_id="", environment_name="", token=""):
     }
 
     logger.info("Checking index job status: %s", url)
-    response = requests.get(url, headers=headers)
+    response = session.get(url, headers=headers)
     response.raise_for_status()
 
     status = response.json()["status"]
@@ -88,10 +101,10 @@ def run_index(account_id="", environment_name="", catalog_name="", token=""):
     job_id = trigger_index(account_id, environment_name, catalog_name, token)
 
     # Poll for completion
-    polling.poll(
+    wait_until(
         lambda: check_index_status(job_id, environment_name, token),
-        step=10,
-        timeout=7200
+        timeout=7200,
+        max_step=10
     )
 
     logger.info("Index operation completed successfully")
@@ -1,22 +1,36 @@
-import gzip
-import json
-import jsonlines
+import io
 import logging
+import orjson
+from isal import igzip
 from os import getenv
 
 logger = logging.getLogger(__name__)
 
+# Read buffer used when iterating input lines, so each refill pulls a large block of inflated data
+READ_BUFFER_SIZE = 1 << 20
+
+# Serialized output is accumulated up to this size before being handed to the gzip writer
+WRITE_BUFFER_SIZE = 1 << 20
+
 
 def create_patch_from_products_fp(fp_in):
   patch = []
 
-  with gzip.open(fp_in, "rb") as file:
+  with io.BufferedReader(igzip.open(fp_in, "rb"), buffer_size=READ_BUFFER_SIZE) as file:
     for line in file:
-      patch.append(create_add_product_op(json.loads(line)))
+      patch.append(create_add_product_op(orjson.loads(line)))
   
   return patch
 
 
+def process(products):
+  """
+  Generator form of this stage: yields an add product operation per Bloomreach product.
+  """
+  for product in products:
+    yield create_add_product_op(product)
+
+
 # construct an add product operation from shopify product
 def create_add_product_op(product):
   path = "/products/" + product["id"].replace("/", "~1") # JSONPointer compliant replacement
@@ -44,11 +58,15 @@ def main(fp_in, fp_out):
   )
   
   # write JSONLines to stdout
-  with gzip.open(fp_out, "wb") as file:
-    writer = jsonlines.Writer(file)
+  with igzip.open(fp_out, "wb", compresslevel=1) as file:
+    # Compress in large blocks rather than issuing a small write per operation
+    buffer = bytearray()
     for object in patch:
-      writer.write(object)
-    writer.close()
+      buffer += orjson.dumps(object, option=orjson.OPT_APPEND_NEWLINE)
+      if len(buffer) >= WRITE_BUFFER_SIZE:
+        file.write(buffer)
+        buffer.clear()
+    file.write(buffer)
 
 if __name__ == '__main__':
   import argparse
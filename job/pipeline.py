@@ -0,0 +1,224 @@
+import logging
+import multiprocessing
+import orjson
+import os
+import queue
+import shutil
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from isal import igzip
+from itertools import islice
+
+logger = logging.getLogger(__name__)
+
+# Number of records a stage may run ahead of the stage consuming its output
+QUEUE_SIZE = 1024
+
+# Serialized records are accumulated up to this size before being handed to the gzip writer
+WRITE_BUFFER_SIZE = 1 << 20
+
+# Room left for the intermediate files, as a multiple of the compressed Shopify bulk file they derive from
+WORK_DIR_SIZE_FACTOR = 4
+
+# Number of records handed to a worker process per task by parallel_map
+FAN_OUT_CHUNK_SIZE = 256
+
+# Size of the smallest gzip file, holding no data: a 10 byte header, an empty deflate block and an 8 byte trailer
+EMPTY_GZIP_SIZE = 20
+
+# Marks the end of a stage's output on its queue
+_DONE = object()
+
+class _StageError:
+  def __init__(self, error):
+    self.error = error
+
+# Transform bound once per worker process by _init_worker, so its options aren't pickled with every chunk
+_worker_transform = None
+
+def _init_worker(transform):
+  global _worker_transform
+  _worker_transform = transform
+
+def _transform_chunk(records):
+  return [result for record in records for result in _worker_transform(record)]
+
+def threaded(records, maxsize=QUEUE_SIZE):
+  """
+  Run a record generator in a background thread, connected to the caller through a bounded queue.
+  This lets each stage of a chain of generators work while the next one is busy with its output.
+  Errors raised by the generator are re-raised in the consuming thread.
+
+  Args:
+      records: Iterable of records produced by a stage
+      maxsize: Maximum number of records buffered between the two stages
+
+  Returns:
+      generator: The same records, in order
+  """
+  buffer = queue.Queue(maxsize=maxsize)
+
+  def produce():
+    try:
+      for record in records:
+        buffer.put(record)
+    except BaseException as e:
+      buffer.put(_StageError(e))
+      return
+    buffer.put(_DONE)
+
+  # Daemon thread, so a failing consumer doesn't leave the process waiting on a full queue
+  threading.Thread(target=produce, daemon=True).start()
+
+  while True:
+    record = buffer.get()
+    if record is _DONE:
+      return
+    if isinstance(record, _StageError):
+      raise record.error
+    yield record
+
+def parallel_map(records, transform, workers, chunk_size=FAN_OUT_CHUNK_SIZE):
+  """
+  Apply a transform to records in a pool of worker processes, yielding its results in input order.
+  Only a bounded number of chunks is in flight at any time, so records are consumed as results are.
+  Workers are started by a forkserver rather than forked from this process, which by then runs
+  reader threads (e.g. rapidgzip's) that a forked child would inherit in an undefined state.
+
+  Args:
+      records: Iterable of picklable records
+      transform: Picklable function returning an iterable of results for one record, e.g. a
+          functools.partial of a module level function; it is sent to each worker once
+      workers: Number of worker processes
+      chunk_size: Number of records handed to a worker per task
+
+  Returns:
+      generator: The results of transform for every record, in order
+  """
+  records = iter(records)
+  chunks = iter(lambda: list(islice(records, chunk_size)), [])
+  with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("forkserver"),
+                           initializer=_init_worker, initargs=(transform,)) as pool:
+    pending = deque()
+    for chunk in chunks:
+      pending.append(pool.submit(_transform_chunk, chunk))
+      # Keep every worker busy without reading the whole input ahead of the consumer
+      if len(pending) >= workers * 2:
+        yield from pending.popleft().result()
+
+    while pending:
+      yield from pending.popleft().result()
+
+def write_jsonl(records, fp):
+  """
+  Write records to a gzipped JSONL file; ISA-L at level 1 favours speed over ratio.
+
+  Args:
+      records: Iterable of JSON serializable records
+      fp: Output file path
+
+  Returns:
+      int: Number of records written
+  """
+  count = 0
+  with igzip.open(fp, "wb", compresslevel=1) as file:
+    buffer = bytearray()
+    for record in records:
+      count += 1
+      buffer += orjson.dumps(record, option=orjson.OPT_APPEND_NEWLINE)
+      if len(buffer) >= WRITE_BUFFER_SIZE:
+        file.write(buffer)
+        buffer.clear()
+    file.write(buffer)
+  return count
+
+def tee_jsonl(records, fp):
+  """
+  Pass records through unchanged while also writing them to a gzipped JSONL checkpoint file.
+
+  Args:
+      records: Iterable of JSON serializable records
+      fp: Checkpoint file path
+
+  Returns:
+      generator: The same records, in order
+  """
+  with igzip.open(fp, "wb", compresslevel=1) as file:
+    buffer = bytearray()
+    for record in records:
+      # Serialize before handing the record on, so later stages are free to modify it
+      buffer += orjson.dumps(record, option=orjson.OPT_APPEND_NEWLINE)
+      if len(buffer) >= WRITE_BUFFER_SIZE:
+        file.write(buffer)
+        buffer.clear()
+      yield record
+    file.write(buffer)
+  logger.info("Saved checkpoint file: %s", fp)
+
+def pipe(records, checkpoint_fp=None):
+  """
+  Run a stage in its own thread, optionally saving its output to a checkpoint file.
+
+  Args:
+      records: Iterable of records produced by a stage
+      checkpoint_fp: Optional gzipped JSONL file path to save the stage output to
+
+  Returns:
+      generator: The same records, in order
+  """
+  if checkpoint_fp:
+    records = tee_jsonl(records, checkpoint_fp)
+  return threaded(records)
+
+def is_empty_jsonl(fp):
+  """
+  Whether a gzipped JSONL file holds no records, mostly without inflating it: a file no larger
+  than an empty gzip stream is empty, and a non-zero ISIZE in the trailer (the uncompressed
+  size of the last gzip member) means it is not. Only when the last member is empty is the
+  file read, since it may be preceded by others, e.g. the shards of a product export.
+
+  Args:
+      fp: Gzipped JSONL file path
+
+  Returns:
+      bool: True if the file holds no records
+  """
+  with open(fp, 'rb') as file:
+    if os.fstat(file.fileno()).st_size <= EMPTY_GZIP_SIZE:
+      return True
+    file.seek(-4, os.SEEK_END)
+    if int.from_bytes(file.read(4), 'little'):
+      return False
+    file.seek(0)
+    with igzip.IGzipFile(fileobj=file) as gz:
+      return not gz.readline()
+
+def get_work_dir(work_root, run_num, input_fp, fallback_dir):
+  """
+  Choose where to save the intermediate stage files: a per-run directory under work_root
+  (e.g. a tmpfs such as /dev/shm) when it has room for them, otherwise fallback_dir.
+
+  Args:
+      work_root: Directory to create the per-run work directory in, or None to use fallback_dir
+      run_num: Run number used to name the work directory
+      input_fp: Shopify bulk file the intermediate files are derived from, used to estimate their size
+      fallback_dir: Directory used when work_root is unset, missing or too small
+
+  Returns:
+      str: Directory to save the intermediate files to
+  """
+  if not work_root or not os.path.isdir(work_root):
+    return fallback_dir
+
+  required_bytes = os.path.getsize(input_fp) * WORK_DIR_SIZE_FACTOR
+  free_bytes = shutil.disk_usage(work_root).free
+  if free_bytes < required_bytes:
+    logger.warning("Not enough space in %s for intermediate files (%s bytes free, %s needed), using %s",
+                   work_root, free_bytes, required_bytes, fallback_dir)
+    return fallback_dir
+
+  work_dir = os.path.join(work_root, f"br_run_{run_num}")
+  os.makedirs(work_dir, exist_ok=True)
+  logger.info("Saving intermediate files to %s", work_dir)
+  return work_dir
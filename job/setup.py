@@ -0,0 +1,15 @@
+# Optional build of the generic product transformation as a C extension with mypyc.
+# The job runs from source without it; see "Compiling the Transformation Module" in readme.md.
+#
+#   pip install -r requirements-compile.txt
+#   python setup.py build_ext --inplace
+#
+# The extension is written next to bloomreach_generics.py and is imported in its place.
+from setuptools import setup
+from mypyc.build import mypycify
+
+setup(
+  name="bloomreach-generics",
+  py_modules=[],
+  ext_modules=mypycify(["bloomreach_generics.py"]),
+)
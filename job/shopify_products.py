@@ -1,83 +1,122 @@
-import gzip
-import json
-import jsonlines
+import io
 import logging
-from collections import defaultdict
+import orjson
+import rapidgzip
+import re
+from isal import igzip
 from os import getenv
+from utils import available_cpus
 
 logger = logging.getLogger(__name__)
 
-def parse_shopify_objects(fp):
-  objects = {}
-  parent_to_children = defaultdict(list)
-  products = []
-
-  with gzip.open(fp, 'rb') as file:
-    for line in file:
-      index_object(json.loads(line), objects, parent_to_children)
-
-    for k in objects.keys():
-      if "/Product/" in k and "/Collection/" not in k:
-        product = create_product_from_objects(k, objects, parent_to_children)
-        products.append(product)
-
-  return products
-
-def index_object(shopify_object, objects, parent_to_children):
-  shopify_id = shopify_object["id"]
-
-  if "/shopify/Collection/" in shopify_id:
-    shopify_id = shopify_object["id"] + shopify_object["__parentId"]
+# Read buffer used when iterating the bulk file, so each refill pulls a large block of inflated data
+READ_BUFFER_SIZE = 1 << 20
 
-  objects[shopify_id] = shopify_object
+# Serialized output is accumulated up to this size before being handed to the gzip writer
+WRITE_BUFFER_SIZE = 1 << 20
 
-  if "__parentId" in shopify_object:
-    parent_to_children[shopify_object["__parentId"]].append(shopify_id)
+# Object types the product aggregation reads; bulk file lines mentioning none of them are skipped before parsing
+INDEXED_TYPES = re.compile(rb"/(?:Product|ProductVariant|Metafield|Collection)/")
 
-def create_product_from_objects(k, objects, parent_to_children):
-  collections, variants, metafields = [], [], []
+# Tags for the object types, looked up once per object from the type segment of its gid://shopify/<Type>/<id>
+PRODUCT, PRODUCT_VARIANT, METAFIELD, COLLECTION = range(4)
+OBJECT_TYPES = {"Product": PRODUCT, "ProductVariant": PRODUCT_VARIANT, "Metafield": METAFIELD, "Collection": COLLECTION}
 
-  children_ids = parent_to_children[k]
-  for child_id in children_ids:
-    if "/Collection/" in child_id:
-            collection = objects[child_id].copy()
-            if collection.get("translations"):
-                locales = set()
-                for translation in collection["translations"]:
-                    locale = translation["locale"]
-                    locales.add(locale)
-                    key = translation["key"]
-                    value = translation["value"]
-                    collection[key] = value
+def object_type(shopify_id):
+  return OBJECT_TYPES.get(shopify_id.split("/", 4)[3])
 
-                collection["translation_done"] = "-".join(sorted(locales))
-                del collection["translations"]
-            collections.append(collection)
-    elif "/ProductVariant/" in child_id:
-      variants.append(create_variant(child_id, objects, parent_to_children))
-    elif "/Metafield/" in child_id:
-      if "/Product/" in objects[child_id]["__parentId"]:
-        metafields.append(objects[child_id])
-
-  product = objects[k]
+def parse_shopify_objects(fp):
+  return list(process(fp))
+
+def open_gzip_reader(fp):
+  """
+  Open a gzipped file for line iteration, decompressing it with rapidgzip across the available CPUs.
+  """
+  return io.BufferedReader(rapidgzip.open(fp, parallelization=available_cpus()), buffer_size=READ_BUFFER_SIZE)
+
+def process(fp):
+  """
+  Generator form of this stage: yields aggregated Shopify products from a bulk operation file.
+
+  Bulk operation files list every object after its parent, and all of a product's collections,
+  metafields, variants and variant metafields before the next product, so a product is complete as
+  soon as the next one starts. A variant's metafields don't necessarily follow it directly, though:
+  they may come after its sibling variants, so they are collected per variant id and attached
+  once the product is complete. Only the children of the current product are kept in memory.
+  """
+  product = None
+  collections, variants, metafields, variant_metafields = [], [], [], {}
+
+  with open_gzip_reader(fp) as file:
+    for line in file:
+      if not INDEXED_TYPES.search(line):
+        continue
+
+      shopify_object = orjson.loads(line)
+      shopify_id = shopify_object["id"]
+      shopify_type = object_type(shopify_id)
+      parent_id = shopify_object.get("__parentId")
+
+      if parent_id is None:
+        if shopify_type == PRODUCT:
+          if product is not None:
+            yield create_product(product, collections, variants, metafields, variant_metafields)
+          product = shopify_object
+          collections, variants, metafields, variant_metafields = [], [], [], {}
+        continue
+
+      if parent_id in variant_metafields:
+        if shopify_type == METAFIELD:
+          variant_metafields[parent_id].append(shopify_object)
+        continue
+
+      if product is None or parent_id != product["id"]:
+        logger.warning("Skipping %s, its parent %s is not the product being read", shopify_id, parent_id)
+        continue
+
+      if shopify_type == COLLECTION:
+        collections.append(create_collection(shopify_object))
+      elif shopify_type == PRODUCT_VARIANT:
+        variants.append(shopify_object)
+        variant_metafields[shopify_id] = []
+      elif shopify_type == METAFIELD:
+        metafields.append(shopify_object)
+
+  if product is not None:
+    yield create_product(product, collections, variants, metafields, variant_metafields)
+
+def create_collection(collection):
+  # Each collection line is parsed for the one product it belongs to, so it is updated in place
+  translations = collection.get("translations")
+  if translations:
+    locales = []
+    set_value = collection.__setitem__
+    for translation in translations:
+      locales.append(translation["locale"])
+      set_value(translation["key"], translation["value"])
+
+    collection["translation_done"] = "-".join(sorted(set(locales)))
+    del collection["translations"]
+  return collection
+
+def create_product(product, collections, variants, metafields, variant_metafields):
+  for variant in variants:
+    variant["metafields"] = variant_metafields.pop(variant["id"], [])
 
   # Handle translations
-  if product.get("translations"):
-    locales = set()
-    for translation in product["translations"]:
-      locale = translation["locale"]
-      locales.add(locale)
+  translations = product.get("translations")
+  if translations:
+    locales = []
+    set_value = product.__setitem__
+    for translation in translations:
+      locales.append(translation["locale"])
       key = translation["key"]
-      value = translation["value"]
 
       # Map body_html to descriptionHtml, otherwise use the key as is
-      if key == "body_html":
-        product["descriptionHtml"] = value
-      else:
-        product[key] = value
+      set_value("descriptionHtml" if key == "body_html" else key, translation["value"])
 
     # Add translationDone field and remove translations
-    product["translation_done"] = "-".join(sorted(locales))
+    product["translation_done"] = "-".join(sorted(set(locales)))
     del product["translations"]
 
   product["collections"] = collections
@@ -86,27 +125,17 @@ def create_product_from_objects(k, objects, parent_to_children):
 
   return product
 
-def create_variant(variant_id, objects, parent_to_children):
-  metafields = []
-
-  children_ids = parent_to_children[variant_id]
-  for child_id in children_ids:
-    if "/Metafield/" in child_id:
-      if "/ProductVariant/" in objects[child_id]["__parentId"]:
-        metafields.append(objects[child_id])
-
-  variant = objects[variant_id]
-  variant["metafields"] = metafields
-  return variant
-
 def main(fp_in, fp_out):
-  products = parse_shopify_objects(fp_in)
-
-  with gzip.open(fp_out, "wb") as out:
-    writer = jsonlines.Writer(out)
-    for object in products:
-      writer.write(object)
-    writer.close()
+  # The output is an intermediate file, so favour speed over ratio
+  with igzip.open(fp_out, "wb", compresslevel=1) as out:
+    # Compress in large blocks rather than issuing a small write per product
+    buffer = bytearray()
+    for object in process(fp_in):
+      buffer += orjson.dumps(object, option=orjson.OPT_APPEND_NEWLINE)
+      if len(buffer) >= WRITE_BUFFER_SIZE:
+        out.write(buffer)
+        buffer.clear()
+    out.write(buffer)
 
 if __name__ == '__main__':
   import argparse
@@ -0,0 +1,52 @@
+import os
+import shopify
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+import graphql
+
+TOKEN = "shpat_test"
+
+def current_token():
+  return shopify.ShopifyResource.get_headers().get("X-Shopify-Access-Token")
+
+class SessionExecutorTest(unittest.TestCase):
+  """
+  ShopifyAPI keeps the access token header per thread, so worker threads must activate the session themselves.
+  Run with: python -m unittest discover
+  """
+
+  def setUp(self):
+    self.session = shopify.Session("test-shop.myshopify.com", "2026-01", TOKEN)
+
+  def test_worker_thread_has_token(self):
+    with graphql.session_executor(self.session, max_workers=2) as executor:
+      self.assertEqual(executor.submit(current_token).result(), TOKEN)
+
+  def test_shard_threads_have_token(self):
+    seen_tokens = []
+
+    def export_shard(products_jsonl_fp, language=None, start_date=None, product_filter=None, wait_for_clear=True):
+      seen_tokens.append(current_token())
+      with open(products_jsonl_fp, 'wb') as f:
+        f.write(graphql.EMPTY_GZIP)
+      return "gid://shopify/BulkOperation/1", 0
+
+    filters = ["created_at:<'2024-01-01T00:00:00Z'", "created_at:>='2024-01-01T00:00:00Z'"]
+    with tempfile.TemporaryDirectory() as output_dir, \
+         mock.patch.object(graphql, "get_created_at_filters", return_value=filters), \
+         mock.patch.object(graphql, "export_products_jsonl", side_effect=export_shard):
+      # Sharded exports also run from the product export thread, which has no session of its own
+      thread = threading.Thread(target=graphql.export_products_jsonl_sharded,
+                                args=(f"{output_dir}/1_shopify_bulk_op.jsonl.gz", self.session),
+                                kwargs={"shards": len(filters)})
+      thread.start()
+      thread.join()
+      self.assertTrue(os.path.exists(f"{output_dir}/1_shopify_bulk_op.jsonl.gz"))
+
+    self.assertEqual(seen_tokens, [TOKEN] * len(filters))
+
+if __name__ == '__main__':
+  unittest.main()
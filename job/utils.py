@@ -0,0 +1,60 @@
+import math
+import os
+import time
+
+# Bounds of the wait between polls, growing by backoff from the first to the last
+POLL_INITIAL_STEP = 1.0
+POLL_MAX_STEP = 20.0
+POLL_BACKOFF = 1.5
+
+def wait_until(fn, step=POLL_INITIAL_STEP, timeout=7200, backoff=POLL_BACKOFF, max_step=POLL_MAX_STEP):
+  """
+  Call fn until it returns a truthy value, growing the wait between calls by backoff up to max_step.
+  Jobs that finish quickly are picked up within seconds, while long running ones are
+  only polled every max_step seconds.
+
+  Args:
+      fn: Function to call, returning a truthy value once done
+      step: Wait after the first unsuccessful call in seconds
+      timeout: Maximum time to wait in seconds
+      backoff: Factor the wait is multiplied by after each unsuccessful call
+      max_step: Longest wait between calls in seconds
+
+  Returns:
+      The first truthy value returned by fn
+  """
+  deadline = time.monotonic() + timeout
+  while True:
+    result = fn()
+    if result:
+      return result
+    if time.monotonic() + step > deadline:
+      raise TimeoutError(f"Polling did not succeed within {timeout} seconds")
+    time.sleep(step)
+    step = min(step * backoff, max_step)
+
+def available_cpus():
+  """
+  Number of CPUs this process may actually use: the CPUs it is allowed to run on, further
+  limited by a cgroup CPU quota such as a container's CPU limit (v2 cpu.max or v1 cfs quota).
+
+  Returns:
+      int: At least 1
+  """
+  try:
+    cpus = len(os.sched_getaffinity(0))
+  except AttributeError:
+    cpus = os.cpu_count() or 1
+
+  for quota_files in (("/sys/fs/cgroup/cpu.max",),
+                      ("/sys/fs/cgroup/cpu/cpu.cfs_quota_us", "/sys/fs/cgroup/cpu/cpu.cfs_period_us")):
+    try:
+      values = " ".join(open(f).read() for f in quota_files).split()
+    except OSError:
+      continue
+    quota, period = values[0], values[1]
+    if quota not in ("max", "-1"):
+      cpus = min(cpus, math.ceil(int(quota) / int(period)))
+    break
+
+  return max(cpus, 1)
@@ -0,0 +1,84 @@
+import base64
+import hashlib
+import hmac
+import json
+import logging
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+
+class BulkOperationListener:
+  """
+  Receives Shopify `bulk_operations/finish` webhooks on a local port and lets callers
+  wait for a given bulk operation to finish instead of polling for its status.
+  """
+
+  def __init__(self, port, secret=None):
+    """
+    Args:
+        port: Local port to listen on
+        secret: Optional app secret used to verify the X-Shopify-Hmac-Sha256 header
+    """
+    self.secret = secret
+    self._finished = {}
+    self._lock = threading.Lock()
+    self._server = ThreadingHTTPServer(("", port), self._handler_class())
+    self._server.daemon_threads = True
+
+  def start(self):
+    threading.Thread(target=self._server.serve_forever, daemon=True).start()
+    logger.info("Listening for bulk operation webhooks on port %s", self._server.server_address[1])
+
+  def stop(self):
+    self._server.shutdown()
+    self._server.server_close()
+
+  def _event(self, job_id):
+    with self._lock:
+      return self._finished.setdefault(job_id, threading.Event())
+
+  def wait(self, job_id, timeout):
+    """
+    Wait until a finish webhook for job_id arrives, or timeout seconds pass.
+
+    Returns:
+        bool: True if the webhook for job_id has arrived
+    """
+    return self._event(job_id).wait(timeout)
+
+  def verify(self, body, signature):
+    if not self.secret:
+      return True
+    digest = hmac.new(self.secret.encode(), body, hashlib.sha256).digest()
+    return hmac.compare_digest(base64.b64encode(digest).decode(), signature or "")
+
+  def notify(self, body):
+    job_id = json.loads(body).get("admin_graphql_api_id")
+    if job_id:
+      logger.info("Received bulk operation finish webhook for job id: %s", job_id)
+      self._event(job_id).set()
+
+  def _handler_class(self):
+    listener = self
+
+    class Handler(BaseHTTPRequestHandler):
+      def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if not listener.verify(body, self.headers.get("X-Shopify-Hmac-Sha256")):
+          logger.warning("Ignoring webhook with an invalid signature")
+          self.send_response(401)
+          self.end_headers()
+          return
+        try:
+          listener.notify(body)
+        except ValueError as e:
+          logger.warning("Ignoring malformed webhook: %s", e)
+        self.send_response(200)
+        self.end_headers()
+
+      def log_message(self, format, *args):
+        logger.debug(format, *args)
+
+    return Handler